@@ -0,0 +1,231 @@
+"""
+Async SocraQuest Quiz Services
+Non-blocking (Motor) versions of the core_services functions on the hot user
+request path, under the same names, for `async def` endpoints:
+
+    import async_core_services as aio
+    pack = await aio.generate_daily_pack(today)
+
+Reads go through Motor and share core_services' process-local caches, so the
+sync and async layers see the same packs, payloads and pack version. Rare or
+write-heavy paths (generating a pack, rendering a payload, backfilling a
+user's daily state) delegate to the sync implementation in the threadpool.
+core_services stays the complete sync API for scripts and test_core.py.
+"""
+from datetime import date
+from typing import List, Dict, Optional, Any
+from bson import ObjectId
+from starlette.concurrency import run_in_threadpool
+
+import core_services as core
+from core_services import serialize_doc
+from database import get_async_db
+
+# MongoDB connection (shared per-process Motor client, same database as core_services)
+db = get_async_db()
+
+# Collections
+topics_col = db['topics']
+users_col = db['users']
+groups_col = db['groups']
+daily_packs_col = db['daily_packs']
+leaderboard_col = db['leaderboards']
+daily_totals_col = db['daily_totals']
+user_daily_state_col = db['user_daily_state']
+cache_versions_col = db['cache_versions']
+quiz_payloads_col = db['quiz_payloads']
+
+
+def _date_str(pack_date) -> str:
+    return pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+
+
+# ============================================================================
+# PACKS
+# ============================================================================
+
+async def _sync_pack_cache_version() -> None:
+    """Drop cached packs if another worker bumped the version (time-gated)"""
+    if core._pack_version_check_due():
+        doc = await cache_versions_col.find_one({'_id': core.PACKS_VERSION_ID})
+        core._apply_pack_version(doc['version'] if doc else 0)
+
+
+async def get_pack_version() -> int:
+    """Current pack version as last seen by this worker"""
+    await _sync_pack_cache_version()
+    return core._pack_cache_version or 0
+
+
+async def get_pack(pack_date) -> Optional[Dict[str, Any]]:
+    """Get the stored (serialized, read-only) pack for a date without generating it"""
+    date_str = _date_str(pack_date)
+    await _sync_pack_cache_version()
+
+    pack = core._pack_cache.get(date_str)
+    if pack is not None:
+        return pack
+
+    doc = await daily_packs_col.find_one({'date': date_str})
+    if not doc:
+        return None
+    pack = serialize_doc(doc)
+    core._cache_pack(date_str, pack)
+    return pack
+
+
+async def generate_daily_pack(pack_date: date) -> Dict[str, Any]:
+    """Get the daily pack, generating it (single-flight, in the threadpool) if missing"""
+    pack = await get_pack(pack_date)
+    if pack:
+        return pack
+    return await run_in_threadpool(core.generate_daily_pack, pack_date)
+
+
+# ============================================================================
+# QUIZ PAYLOADS
+# ============================================================================
+
+async def get_quiz_payload(pack_date, quiz_index: int, language: str = 'en') -> List[Dict[str, Any]]:
+    """Get the prerendered questions of a quiz; rendering a missing payload runs in the threadpool"""
+    date_str = _date_str(pack_date)
+    key = (date_str, quiz_index, language)
+    await _sync_pack_cache_version()
+
+    questions = core._quiz_payload_cache.get(key)
+    if questions is not None:
+        return questions
+
+    # Only a payload rendered from the current pack counts
+    pack = await get_pack(date_str)
+    stored = await quiz_payloads_col.find_one(
+        {'date': date_str, 'quiz_index': quiz_index, 'lang': language},
+        {'questions': 1, 'pack_id': 1}
+    )
+    if not pack or not core._payload_is_current(stored, pack):
+        return await run_in_threadpool(core.get_quiz_payload, date_str, quiz_index, language)
+
+    questions = stored['questions']
+    core._cache_quiz_payload(key, questions)
+    return questions
+
+
+async def get_quiz_for_attempt(pack_date, quiz_index: int, language: str,
+                               attempt_num: int) -> List[Dict[str, Any]]:
+    """Get the prerendered questions of a quiz with the option order of an attempt"""
+    questions = await get_quiz_payload(pack_date, quiz_index, language)
+    pack = await get_pack(pack_date)
+    return [
+        core.apply_option_order(q, core._pack_option_order(pack, q['_id'], attempt_num))
+        for q in questions
+    ]
+
+
+# ============================================================================
+# USER DAILY STATE
+# ============================================================================
+
+async def get_user_daily_state(user_id: str, pack_date) -> List[Dict[str, Any]]:
+    """Get the user's state for all quizzes of the day; the first read of a day backfills in the threadpool"""
+    state = await user_daily_state_col.find_one(
+        {'user_id': ObjectId(user_id), 'date': _date_str(pack_date)},
+        {'slots': 1, 'backfilled': 1}
+    )
+    if state is None or not state.get('backfilled'):
+        return await run_in_threadpool(core.get_user_daily_state, user_id, pack_date)
+    return core._daily_state_from_slots(state.get('slots', {}))
+
+
+# ============================================================================
+# LEADERBOARDS
+# ============================================================================
+
+async def _group_member_filter(group_id: Optional[str]) -> Dict[str, Any]:
+    """Build a user_id filter restricting results to the members of a group"""
+    if group_id:
+        group = await groups_col.find_one({'_id': ObjectId(group_id)}, {'members': 1})
+        if group and 'members' in group:
+            return {'user_id': {'$in': group['members']}}
+    return {}
+
+
+async def _ensure_materialized(date_str: str, quiz_index: Optional[int] = None) -> None:
+    """Backfill a board from results in the threadpool unless it is known to be materialized"""
+    if (date_str, quiz_index) not in core._materialized_boards:
+        await run_in_threadpool(core.ensure_leaderboard_materialized, date_str, quiz_index)
+
+
+async def _ranking_page(collection, sort: List, base_query: Dict, row_builder,
+                        limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+    query, rank_offset = core._ranking_page_query(sort, base_query, cursor)
+    entries = await collection.find(query).sort(sort).limit(limit + 1).to_list(length=limit + 1)
+    return core._ranking_page_result(sort, row_builder, entries, limit, rank_offset)
+
+
+async def get_user_rank(user_id: str, pack_date, quiz_index: int,
+                        group_id: Optional[str] = None) -> Optional[int]:
+    """Get a user's rank on a quiz leaderboard (None if no result)"""
+    date_str = _date_str(pack_date)
+    user_oid = ObjectId(user_id)
+    await _ensure_materialized(date_str, quiz_index)
+
+    entry = await leaderboard_col.find_one({
+        'date': date_str,
+        'quiz_index': quiz_index,
+        'user_id': user_oid
+    })
+    if not entry:
+        return None
+
+    better_count = await leaderboard_col.count_documents({
+        'date': date_str,
+        'quiz_index': quiz_index,
+        **(await _group_member_filter(group_id)),
+        **core._ranked_before_filter(core.LEADERBOARD_SORT, entry['best_pct'], entry['best_time_ms'], user_oid)
+    })
+    return better_count + 1
+
+
+async def get_leaderboard_page(pack_date, quiz_index: int, limit: int = 100,
+                               cursor: Optional[str] = None,
+                               group_id: Optional[str] = None) -> Dict[str, Any]:
+    """Get one keyset-paginated page of a quiz leaderboard"""
+    await _ensure_materialized(_date_str(pack_date), quiz_index)
+    base_query = {
+        'date': _date_str(pack_date),
+        'quiz_index': quiz_index,
+        **(await _group_member_filter(group_id))
+    }
+    return await _ranking_page(leaderboard_col, core.LEADERBOARD_SORT, base_query,
+                               core._leaderboard_row, limit, cursor)
+
+
+async def get_daily_ranking_page(pack_date, limit: int = 100,
+                                 cursor: Optional[str] = None,
+                                 group_id: Optional[str] = None) -> Dict[str, Any]:
+    """Get one keyset-paginated page of the overall daily ranking"""
+    await _ensure_materialized(_date_str(pack_date))
+    base_query = {
+        'date': _date_str(pack_date),
+        **(await _group_member_filter(group_id))
+    }
+    return await _ranking_page(daily_totals_col, core.DAILY_TOTALS_SORT, base_query,
+                               core._daily_ranking_row, limit, cursor)
+
+
+# ============================================================================
+# USERS
+# ============================================================================
+
+async def find_user(user_id: str, projection: Optional[Dict] = None) -> Optional[Dict]:
+    """Read a user document by id"""
+    return await users_col.find_one({'_id': ObjectId(user_id)}, projection)
+
+
+async def get_topic_names(topic_ids: List) -> Dict[str, str]:
+    """Resolve topic ids to names with one query"""
+    oids = [ObjectId(topic_id) for topic_id in topic_ids]
+    return {
+        str(t['_id']): t['name']
+        async for t in topics_col.find({'_id': {'$in': oids}}, {'name': 1})
+    }
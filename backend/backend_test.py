@@ -219,7 +219,7 @@ class SocraQuestAPITester:
             print(f"   🔄 Attempt number: {response.get('attempt_number', 0)}")
         return success, response
 
-    def test_submit_quiz(self, quiz_index=0, answers=None):
+    def test_submit_quiz(self, quiz_index=0, answers=None, attempt_number=1):
         """Test submit quiz"""
         if not answers:
             # Get quiz first to get question IDs
@@ -229,6 +229,7 @@ class SocraQuestAPITester:
             
             # Create dummy answers (all A)
             questions = quiz_data.get('questions', [])
+            attempt_number = quiz_data.get('attempt_number', attempt_number)
             answers = [
                 {"question_id": q['_id'], "choice_key": "A"}
                 for q in questions
@@ -241,7 +242,8 @@ class SocraQuestAPITester:
             200,
             data={
                 "answers": answers,
-                "time_ms": 30000
+                "time_ms": 30000,
+                "attempt_number": attempt_number
             }
         )
         if success:
@@ -2,17 +2,21 @@
 Core SocraQuest Quiz Services - POC Implementation
 Handles: pack generation, answer randomization, scoring, leaderboards, quiz locking
 """
-import os
+import json
+import base64
 import random
-from datetime import datetime, date
+import threading
+import time
+from datetime import datetime, date, timedelta
 from typing import List, Dict, Optional, Any
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING, ReturnDocument
+from pymongo.errors import DuplicateKeyError
 from bson import ObjectId
 
-# MongoDB connection
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URL)
-db = client['socraquest']
+from database import get_db
+
+# MongoDB connection (shared per-process client)
+db = get_db()
 
 # Collections
 topics_col = db['topics']
@@ -27,7 +31,21 @@ manual_ads_col = db['manual_ads']  # Manual ads collection
 notification_settings_col = db['notification_settings']  # User notification preferences
 notification_logs_col = db['notification_logs']  # Notification history
 user_devices_col = db['user_devices']  # FCM tokens
-used_questions_col = db['used_questions']  # Track globally used questions to prevent repeats
+used_questions_col = db['used_questions']  # Usage cycle tracker for the no-repeat system
+leaderboard_col = db['leaderboards']  # Materialized per-(date, quiz) leaderboard entries
+daily_totals_col = db['daily_totals']  # Materialized per-(user, date) overall totals
+user_daily_state_col = db['user_daily_state']  # Per-(user, date) attempts/lock/best for all 11 quizzes
+post_submit_events_col = db['post_submit_events']  # Outbox for asynchronous post-submit side effects
+leases_col = db['leases']  # Cross-worker leases (single-flight jobs)
+cache_versions_col = db['cache_versions']  # Cross-worker cache invalidation counters
+quiz_payloads_col = db['quiz_payloads']  # Prerendered per-(date, quiz, language) question sets
+
+QUIZZES_PER_DAY = 11  # 10 regular quizzes + 1 bonus
+TOPICS_PER_QUIZ = 10
+QUESTIONS_PER_TOPIC = 3
+QUESTIONS_PER_PACK = QUIZZES_PER_DAY * TOPICS_PER_QUIZ * QUESTIONS_PER_TOPIC  # 330
+MIN_ACTIVE_TOPICS = TOPICS_PER_QUIZ
+MAX_ATTEMPTS = 3
 
 
 def serialize_doc(doc: Optional[Dict]) -> Optional[Dict]:
@@ -62,118 +80,394 @@ def serialize_doc(doc: Optional[Dict]) -> Optional[Dict]:
     return doc
 
 
-def generate_daily_pack(pack_date: date) -> Dict[str, Any]:
+def count_active_questions_by_topic() -> Dict[ObjectId, int]:
     """
-    Generate daily pack with 11 quizzes.
-    Each quiz contains 10 topics (30 questions total per quiz).
+    Count active questions per topic with a single $group aggregation.
     
-    QUESTION NON-REPEAT LOGIC:
-    - Tracks all questions used globally in 'used_questions' collection
-    - Questions won't repeat until ALL questions in the database have been used
-    - Once all questions are exhausted, the tracking resets automatically
+    Returns:
+        {topic_id (ObjectId): active question count}
+    """
+    return {
+        row['_id']: row['count']
+        for row in questions_col.aggregate([
+            {'$match': {'active': True}},
+            {'$group': {'_id': '$topic_id', 'count': {'$sum': 1}}}
+        ])
+    }
+
+
+# ============================================================================
+# QUESTION USAGE TRACKER
+# ============================================================================
+# The 'global_tracker' document only holds the current usage cycle. A question
+# is used in this cycle when its 'last_used_cycle' equals the tracker's cycle,
+# so marking is an O(batch) update_many and a reset is a single $inc.
+
+USAGE_TRACKER_ID = 'global_tracker'
+LEGACY_MIGRATION_BATCH = 1000
+
+
+def _migrate_legacy_usage_tracker(cycle: int) -> None:
+    """
+    Move a legacy 'question_ids' array off the tracker document onto the
+    questions themselves (one-time migration).
+    
+    The questions are marked before the array is removed, so a crash midway
+    leaves the array in place and the (idempotent) migration runs again.
+    """
+    legacy = used_questions_col.find_one(
+        {'_id': USAGE_TRACKER_ID, 'question_ids': {'$exists': True}},
+        {'question_ids': 1}
+    )
+    if not legacy:
+        return
+    
+    legacy_ids = [ObjectId(q_id) for q_id in legacy.get('question_ids', []) if ObjectId.is_valid(q_id)]
+    for start in range(0, len(legacy_ids), LEGACY_MIGRATION_BATCH):
+        questions_col.update_many(
+            {'_id': {'$in': legacy_ids[start:start + LEGACY_MIGRATION_BATCH]}},
+            {'$set': {'last_used_cycle': cycle}}
+        )
+    
+    used_questions_col.update_one({'_id': USAGE_TRACKER_ID}, {'$unset': {'question_ids': ''}})
+    print(f"🔄 Migrated {len(legacy_ids)} used question IDs to usage cycle {cycle}")
+
+
+def get_usage_cycle() -> int:
+    """
+    Get the current question usage cycle, creating the tracker if needed.
+    
+    Returns:
+        Current cycle number
+    """
+    tracker = used_questions_col.find_one_and_update(
+        {'_id': USAGE_TRACKER_ID},
+        {'$setOnInsert': {'cycle': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    if 'cycle' not in tracker:
+        # Tracker written before cycles existed
+        tracker = used_questions_col.find_one_and_update(
+            {'_id': USAGE_TRACKER_ID, 'cycle': {'$exists': False}},
+            {'$set': {'cycle': 1}},
+            return_document=ReturnDocument.AFTER
+        ) or used_questions_col.find_one({'_id': USAGE_TRACKER_ID})
+    
+    cycle = tracker['cycle']
+    if 'question_ids' in tracker:
+        _migrate_legacy_usage_tracker(cycle)
+    return cycle
+
+
+def read_usage_cycle() -> int:
+    """
+    Get the current question usage cycle without creating or migrating the
+    tracker (for read-only callers such as the capacity forecast).
+    
+    Returns:
+        Current cycle number (1 if there is no tracker yet)
+    """
+    tracker = used_questions_col.find_one({'_id': USAGE_TRACKER_ID}, {'cycle': 1})
+    return tracker.get('cycle', 1) if tracker else 1
+
+
+def mark_questions_used(question_ids: List[str], cycle: int) -> None:
+    """Mark a batch of questions as used in the given cycle"""
+    if not question_ids:
+        return
+    questions_col.update_many(
+        {'_id': {'$in': [ObjectId(q_id) for q_id in question_ids]}},
+        {'$set': {'last_used_cycle': cycle}}
+    )
+    used_questions_col.update_one(
+        {'_id': USAGE_TRACKER_ID},
+        {'$set': {'last_updated': datetime.utcnow()}}
+    )
+
+
+def start_new_usage_cycle(reason: Optional[str] = None) -> int:
+    """
+    Make every question available again by advancing the usage cycle.
+    
+    Returns:
+        The new cycle number
+    """
+    get_usage_cycle()  # Ensure the tracker exists (and is migrated)
+    update = {'$inc': {'cycle': 1}, '$set': {'last_reset': datetime.utcnow()}}
+    if reason:
+        update['$set']['reset_reason'] = reason
+    tracker = used_questions_col.find_one_and_update(
+        {'_id': USAGE_TRACKER_ID},
+        update,
+        return_document=ReturnDocument.AFTER
+    )
+    return tracker['cycle']
+
+
+# ============================================================================
+# LEASES (cross-worker single-flight)
+# ============================================================================
+
+def acquire_lease(name: str, owner: str, ttl_seconds: int) -> bool:
+    """
+    Take (or renew) a named lease held in Mongo.
+    Succeeds when the lease is free, expired, or already held by this owner.
+    
+    Returns:
+        True if this owner now holds the lease
+    """
+    now = datetime.utcnow()
+    try:
+        lease = leases_col.find_one_and_update(
+            {
+                '_id': name,
+                '$or': [{'expires_at': {'$lt': now}}, {'owner': owner}]
+            },
+            {'$set': {
+                'owner': owner,
+                'acquired_at': now,
+                'expires_at': now + timedelta(seconds=ttl_seconds)
+            }},
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+        return lease is not None
+    except DuplicateKeyError:
+        # Lease exists and is held by someone else
+        return False
+
+
+def release_lease(name: str, owner: str) -> None:
+    """Release a lease if this owner still holds it"""
+    leases_col.delete_one({'_id': name, 'owner': owner})
+
+
+# ============================================================================
+# PACK CACHE
+# ============================================================================
+# Serialized packs are cached per process, keyed by date. Packs never change
+# once stored, except through admin actions (regenerate, reset usage, delete
+# all); those bump the 'packs' version counter in Mongo, which every worker
+# re-reads at most every PACK_VERSION_POLL_SECONDS and then drops its cache.
+
+PACK_CACHE_DAYS = 4  # Yesterday/today plus precomputed days
+PACK_VERSION_POLL_SECONDS = 5
+PACKS_VERSION_ID = 'packs'
+
+_pack_cache: Dict[str, Dict[str, Any]] = {}
+_pack_cache_version: Optional[int] = None
+_pack_version_checked_at = 0.0
+
+
+def _read_pack_version() -> int:
+    doc = cache_versions_col.find_one({'_id': PACKS_VERSION_ID})
+    return doc['version'] if doc else 0
+
+
+def _clear_local_pack_caches() -> None:
+    _pack_cache.clear()
+    _answer_key_cache.clear()
+    _quiz_payload_cache.clear()
+
+
+def _pack_version_check_due() -> bool:
+    """True (and restart the poll interval) if the pack version should be re-read"""
+    global _pack_version_checked_at
+    now = time.monotonic()
+    if now - _pack_version_checked_at < PACK_VERSION_POLL_SECONDS:
+        return False
+    _pack_version_checked_at = now
+    return True
+
+
+def _apply_pack_version(version: int) -> None:
+    """Drop cached packs if the version changed since this worker last saw it"""
+    global _pack_cache_version
+    if version != _pack_cache_version:
+        if _pack_cache_version is not None:
+            _clear_local_pack_caches()
+        _pack_cache_version = version
+
+
+def _sync_pack_cache_version() -> None:
+    """Drop cached packs if another worker bumped the version (time-gated)"""
+    if _pack_version_check_due():
+        _apply_pack_version(_read_pack_version())
+
+
+def get_pack_version() -> int:
+    """Current pack version as last seen by this worker (for cache validators)"""
+    _sync_pack_cache_version()
+    return _pack_cache_version or 0
+
+
+def bump_pack_version() -> int:
+    """
+    Invalidate cached packs (and their answer keys) in every worker.
+    Call after packs were regenerated or deleted.
+    
+    Returns:
+        The new version
+    """
+    global _pack_cache_version, _pack_version_checked_at
+    doc = cache_versions_col.find_one_and_update(
+        {'_id': PACKS_VERSION_ID},
+        {'$inc': {'version': 1}},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+    _clear_local_pack_caches()
+    _pack_cache_version = doc['version']
+    _pack_version_checked_at = time.monotonic()
+    return doc['version']
+
+
+def _cache_pack(date_str: str, pack: Dict[str, Any]) -> None:
+    _pack_cache[date_str] = pack
+    for stale_date in sorted(list(_pack_cache))[:-PACK_CACHE_DAYS]:
+        _pack_cache.pop(stale_date, None)
+
+
+def get_pack(pack_date) -> Optional[Dict[str, Any]]:
+    """
+    Get the stored (serialized) pack for a date without generating it.
+    Served from the process-local cache after the first read.
+    Callers must treat the returned pack as read-only.
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    _sync_pack_cache_version()
+    
+    pack = _pack_cache.get(date_str)
+    if pack is not None:
+        return pack
+    
+    doc = daily_packs_col.find_one({'date': date_str})
+    if not doc:
+        return None
+    pack = serialize_doc(doc)
+    _cache_pack(date_str, pack)
+    return pack
+
+
+# ============================================================================
+# DAILY PACK GENERATION
+# ============================================================================
+
+def load_question_bank_index(cycle: int) -> Dict[str, Any]:
+    """
+    Load the active question bank once into a compact in-memory index.
+    Questions get a dense ordinal (in _id order); selection works on ordinals.
+    
+    Args:
+        cycle: Current usage cycle; questions last used in it are marked used
     
     Returns:
         {
-            'date': str (YYYY-MM-DD),
-            'quizzes': [
-                {
-                    'index': 0-10,
-                    'topic_ids': [ObjectId x 10],
-                    'question_ids': [[q1, q2, q3] x 10]  # Pre-selected questions
-                }
-            ],
-            'generated_at': datetime
+            'question_ids': [str],              # ordinal -> question id
+            'correct_keys': [str],              # ordinal -> correct key
+            'by_topic': {topic_id: [ordinal]},  # topic -> its active questions
+            'used': bytearray                   # ordinal -> 1 if already used
         }
     """
-    # Convert date to string for MongoDB storage
-    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    question_ids = []
+    correct_keys = []
+    by_topic = {}
+    used = bytearray()
+    
+    for q in questions_col.find(
+        {'active': True},
+        {'_id': 1, 'topic_id': 1, 'correct_key': 1, 'last_used_cycle': 1}
+    ).sort('_id', ASCENDING):
+        ordinal = len(question_ids)
+        question_ids.append(str(q['_id']))
+        correct_keys.append(q.get('correct_key'))
+        by_topic.setdefault(q['topic_id'], []).append(ordinal)
+        used.append(1 if q.get('last_used_cycle') == cycle else 0)
     
-    # Check if pack already exists
-    existing = daily_packs_col.find_one({'date': date_str})
-    if existing:
-        return serialize_doc(existing)
+    return {
+        'question_ids': question_ids,
+        'correct_keys': correct_keys,
+        'by_topic': by_topic,
+        'used': used
+    }
+
+
+def select_questions_for_topic(bank: Dict[str, Any], topic_id, rng: random.Random) -> List[int]:
+    """
+    Select questions for a topic from the in-memory bank, prioritizing unused questions.
     
-    # Get all active topics with at least 3 questions
-    active_topics = []
-    for topic in topics_col.find({'active': True}):
-        q_count = questions_col.count_documents({
-            'topic_id': topic['_id'],
-            'active': True
-        })
-        if q_count >= 3:
-            active_topics.append(topic['_id'])
-    
-    if len(active_topics) < 10:
-        raise ValueError(f"Need at least 10 topics with 3+ questions each. Found: {len(active_topics)}")
-    
-    # Get set of already-used question IDs
-    used_question_ids = set()
-    used_doc = used_questions_col.find_one({'_id': 'global_tracker'})
-    if used_doc and 'question_ids' in used_doc:
-        used_question_ids = set(used_doc['question_ids'])
-    
-    # Get total active questions count
-    total_active_questions = questions_col.count_documents({'active': True})
-    
-    # Check if we need to reset (all questions used)
-    # We need 330 questions per day (11 quizzes × 10 topics × 3 questions)
-    questions_needed_today = 330
-    available_unused = total_active_questions - len(used_question_ids)
-    
-    if available_unused < questions_needed_today:
-        # Reset tracking - all questions have been used
-        print(f"🔄 Resetting question tracker. Used: {len(used_question_ids)}, Total: {total_active_questions}")
-        used_question_ids = set()
-        used_questions_col.update_one(
-            {'_id': 'global_tracker'},
-            {'$set': {'question_ids': [], 'last_reset': datetime.utcnow()}},
-            upsert=True
-        )
+    Args:
+        bank: Index built by load_question_bank_index
+        topic_id: The topic ObjectId
+        rng: Random number generator for shuffling
     
-    # Use date as seed for deterministic topic selection
-    seed = int(pack_date.strftime('%Y%m%d'))
-    rng = random.Random(seed)
+    Returns:
+        List of question ordinals (up to 3)
+    """
+    topic_oid = ObjectId(topic_id) if not isinstance(topic_id, ObjectId) else topic_id
+    used = bank['used']
+    
+    # Separate the topic's questions into unused and used
+    topic_questions = bank['by_topic'].get(topic_oid, [])
+    unused_questions = [o for o in topic_questions if not used[o]]
+    used_questions = [o for o in topic_questions if used[o]]
+    
+    # Shuffle both lists
+    rng.shuffle(unused_questions)
+    rng.shuffle(used_questions)
+    
+    # Prioritize unused questions, then fall back to used ones
+    return (unused_questions + used_questions)[:QUESTIONS_PER_TOPIC]
+
+
+def _select_pack_quizzes(bank: Dict[str, Any], active_topics: List, image_quiz_topic_id,
+                         rng: random.Random) -> Dict[str, Any]:
+    """
+    Select topics and questions for the 11 quizzes of a pack, entirely in memory.
+    Marks the selected questions as used in bank['used'].
+    
+    Returns:
+        {
+            'quizzes': [{'index', 'topic_ids', 'question_ids'}],
+            'selected_ordinals': [int]  # in selection order
+        }
+    """
+    used = bank['used']
+    question_ids = bank['question_ids']
     
     # Shuffle all topics once for the day
     shuffled_topics = active_topics.copy()
     rng.shuffle(shuffled_topics)
     
-    # Find Image Quiz topic (for Quiz 5, Topic 1)
-    image_quiz_topic = topics_col.find_one({'name': 'Image Quiz', 'active': True})
-    image_quiz_topic_id = image_quiz_topic['_id'] if image_quiz_topic else None
-    
     # Generate 11 quizzes, minimizing topic repeats
     quizzes = []
     used_topic_count = {}
-    newly_used_question_ids = []  # Track questions used in this pack
+    selected_ordinals = []  # Track questions used in this pack
+    
+    def take(topic_id, ordinals):
+        for ordinal in ordinals:
+            used[ordinal] = 1
+            selected_ordinals.append(ordinal)
+        used_topic_count[str(topic_id)] = used_topic_count.get(str(topic_id), 0) + 1
+        return [question_ids[o] for o in ordinals]
     
-    for quiz_idx in range(11):
+    for quiz_idx in range(QUIZZES_PER_DAY):
         quiz_topics = []
         quiz_question_ids = []  # Store pre-selected question IDs for each topic
         
         # Try to select 10 topics, preferring those used least
         candidates = shuffled_topics.copy()
         
-        for topic_slot in range(10):
+        for topic_slot in range(TOPICS_PER_QUIZ):
             # SPECIAL CASE: Quiz 5 (index 4), Topic 1 (slot 0) = Image Quiz
             if quiz_idx == 4 and topic_slot == 0 and image_quiz_topic_id:
                 # Force Image Quiz topic for Quiz 5, first topic
-                topic_questions = select_questions_for_topic(
-                    image_quiz_topic_id, 
-                    used_question_ids, 
-                    rng
-                )
+                topic_questions = select_questions_for_topic(bank, image_quiz_topic_id, rng)
                 
-                if len(topic_questions) >= 3:
+                if len(topic_questions) >= QUESTIONS_PER_TOPIC:
                     quiz_topics.append(image_quiz_topic_id)
-                    selected_q_ids = [str(q['_id']) for q in topic_questions[:3]]
-                    quiz_question_ids.append(selected_q_ids)
-                    
-                    for q_id in selected_q_ids:
-                        used_question_ids.add(q_id)
-                        newly_used_question_ids.append(q_id)
-                    
-                    used_topic_count[str(image_quiz_topic_id)] = used_topic_count.get(str(image_quiz_topic_id), 0) + 1
+                    quiz_question_ids.append(take(image_quiz_topic_id, topic_questions))
                     if image_quiz_topic_id in candidates:
                         candidates.remove(image_quiz_topic_id)
                     continue
@@ -188,35 +482,20 @@ def generate_daily_pack(pack_date: date) -> Dict[str, Any]:
             min_usage = float('inf')
             
             for topic in candidates:
-                topic_str = str(topic)
-                usage = used_topic_count.get(topic_str, 0)
+                usage = used_topic_count.get(str(topic), 0)
                 if usage < min_usage:
                     min_usage = usage
                     best_topic = topic
             
             if best_topic:
-                # Select 3 questions for this topic, excluding already-used ones
-                topic_questions = select_questions_for_topic(
-                    best_topic, 
-                    used_question_ids, 
-                    rng
-                )
+                # Select 3 questions for this topic, preferring unused ones
+                topic_questions = select_questions_for_topic(bank, best_topic, rng)
                 
-                if len(topic_questions) >= 3:
+                if len(topic_questions) >= QUESTIONS_PER_TOPIC:
                     quiz_topics.append(best_topic)
-                    selected_q_ids = [str(q['_id']) for q in topic_questions[:3]]
-                    quiz_question_ids.append(selected_q_ids)
-                    
-                    # Mark these questions as used
-                    for q_id in selected_q_ids:
-                        used_question_ids.add(q_id)
-                        newly_used_question_ids.append(q_id)
-                    
-                    used_topic_count[str(best_topic)] = used_topic_count.get(str(best_topic), 0) + 1
-                    candidates.remove(best_topic)
-                else:
-                    # Topic doesn't have enough unused questions, skip it
-                    candidates.remove(best_topic)
+                    quiz_question_ids.append(take(best_topic, topic_questions))
+                # Either way this topic is done for this quiz
+                candidates.remove(best_topic)
         
         quizzes.append({
             'index': quiz_idx,
@@ -224,94 +503,222 @@ def generate_daily_pack(pack_date: date) -> Dict[str, Any]:
             'question_ids': quiz_question_ids  # Pre-selected questions
         })
     
-    # Update the global used questions tracker
-    if newly_used_question_ids:
-        used_questions_col.update_one(
-            {'_id': 'global_tracker'},
-            {
-                '$addToSet': {'question_ids': {'$each': newly_used_question_ids}},
-                '$set': {'last_updated': datetime.utcnow()}
-            },
-            upsert=True
-        )
-    
-    # Create pack document
-    pack = {
-        'date': date_str,
+    return {
         'quizzes': quizzes,
-        'generated_at': datetime.utcnow(),
-        'questions_used': len(newly_used_question_ids),
-        'total_used_after': len(used_question_ids)
+        'selected_ordinals': selected_ordinals
     }
+
+
+def _load_pack_inputs(cycle: int):
+    """
+    Load everything pack selection needs, once.
     
-    result = daily_packs_col.insert_one(pack)
-    pack['_id'] = result.inserted_id
+    Returns:
+        (bank, active_topics, image_quiz_topic_id)
     
-    print(f"✅ Generated pack for {date_str}: {len(newly_used_question_ids)} new questions used, {len(used_question_ids)}/{total_active_questions} total used")
+    Raises:
+        ValueError: If fewer than MIN_ACTIVE_TOPICS topics have 3+ questions
+    """
+    bank = load_question_bank_index(cycle)
     
-    return serialize_doc(pack)
+    # Get all active topics with at least 3 questions
+    active_topics = [
+        topic['_id'] for topic in topics_col.find({'active': True}, {'_id': 1})
+        if len(bank['by_topic'].get(topic['_id'], [])) >= QUESTIONS_PER_TOPIC
+    ]
+    
+    if len(active_topics) < MIN_ACTIVE_TOPICS:
+        raise ValueError(f"Need at least {MIN_ACTIVE_TOPICS} topics with {QUESTIONS_PER_TOPIC}+ questions each. Found: {len(active_topics)}")
+    
+    # Find Image Quiz topic (for Quiz 5, Topic 1)
+    image_quiz_topic = topics_col.find_one({'name': 'Image Quiz', 'active': True})
+    image_quiz_topic_id = image_quiz_topic['_id'] if image_quiz_topic else None
+    
+    return bank, active_topics, image_quiz_topic_id
 
 
-def select_questions_for_topic(topic_id, used_question_ids: set, rng: random.Random) -> List[Dict]:
+def _plan_daily_pack(bank: Dict[str, Any], active_topics: List, image_quiz_topic_id,
+                     pack_date: date) -> Dict[str, Any]:
     """
-    Select questions for a topic, prioritizing unused questions.
+    Pure in-memory core of pack generation (no database access).
+    Starts a new usage cycle in the bank when fewer than QUESTIONS_PER_PACK
+    questions are unused, then selects the pack with the date-seeded RNG.
+    Updates bank['used'].
     
-    Args:
-        topic_id: The topic ObjectId
-        used_question_ids: Set of already-used question ID strings
-        rng: Random number generator for shuffling
+    Returns:
+        {'quizzes': [...], 'selected_ordinals': [int], 'start_new_cycle': bool}
+    """
+    start_new_cycle = bank['used'].count(0) < QUESTIONS_PER_PACK
+    if start_new_cycle:
+        # All questions have been used - start over
+        bank['used'] = bytearray(len(bank['question_ids']))
+    
+    # Use date as seed for deterministic topic selection
+    rng = random.Random(int(pack_date.strftime('%Y%m%d')))
+    
+    selection = _select_pack_quizzes(bank, active_topics, image_quiz_topic_id, rng)
+    selection['start_new_cycle'] = start_new_cycle
+    return selection
+
+
+PACK_LEASE_SECONDS = 60  # Generation normally takes well under this
+PACK_WAIT_POLL_SECONDS = 0.2
+PACK_WAIT_TIMEOUT_SECONDS = PACK_LEASE_SECONDS * 2  # Covers one crashed generator's lease
+
+_pack_locks: Dict[str, threading.Lock] = {}
+_pack_locks_guard = threading.Lock()
+
+
+def _get_pack_lock(date_str: str) -> threading.Lock:
+    with _pack_locks_guard:
+        lock = _pack_locks.get(date_str)
+        if lock is None:
+            # Drop locks for other dates; they are only needed while generating
+            for stale in [d for d, l in _pack_locks.items() if not l.locked()]:
+                del _pack_locks[stale]
+            lock = _pack_locks[date_str] = threading.Lock()
+        return lock
+
+
+def generate_daily_pack(pack_date: date) -> Dict[str, Any]:
+    """
+    Get the daily pack for a date, generating it if it does not exist yet.
+    
+    Single-flight: within a process, concurrent callers for the same date
+    wait on one lock; across workers, only the holder of the 'pack:<date>'
+    lease generates while the others poll for the stored pack. A crashed
+    generator's lease expires after PACK_LEASE_SECONDS.
     
     Returns:
-        List of question documents (up to 3)
+        The pack document (see _generate_daily_pack)
+    
+    Raises:
+        ValueError: If the pack cannot be generated, or another worker's pack
+                    did not appear within PACK_WAIT_TIMEOUT_SECONDS
     """
-    topic_oid = ObjectId(topic_id) if not isinstance(topic_id, ObjectId) else topic_id
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    
+    # Fast path: pack already exists (usually served from the local cache)
+    existing = get_pack(date_str)
+    if existing:
+        return existing
     
-    # Get all active questions for this topic
-    all_questions = list(questions_col.find({
-        'topic_id': topic_oid,
-        'active': True
-    }))
+    with _get_pack_lock(date_str):
+        lease_name = f'pack:{date_str}'
+        owner = str(ObjectId())
+        deadline = time.monotonic() + PACK_WAIT_TIMEOUT_SECONDS
+        
+        while True:
+            existing = get_pack(date_str)
+            if existing:
+                return existing
+            
+            if acquire_lease(lease_name, owner, PACK_LEASE_SECONDS):
+                try:
+                    pack = _generate_daily_pack(pack_date)
+                finally:
+                    release_lease(lease_name, owner)
+                _cache_pack(date_str, pack)
+                return pack
+            
+            # Another worker is generating; wait for its pack
+            if time.monotonic() >= deadline:
+                raise ValueError(f"Timed out waiting for the pack for {date_str}")
+            time.sleep(PACK_WAIT_POLL_SECONDS)
+
+
+def _generate_daily_pack(pack_date: date) -> Dict[str, Any]:
+    """
+    Generate daily pack with 11 quizzes.
+    Each quiz contains 10 topics (30 questions total per quiz).
     
-    # Separate into unused and used
-    unused_questions = [q for q in all_questions if str(q['_id']) not in used_question_ids]
-    used_questions = [q for q in all_questions if str(q['_id']) in used_question_ids]
+    QUESTION NON-REPEAT LOGIC:
+    - Each question records the usage cycle it was last used in ('last_used_cycle')
+    - Questions won't repeat until ALL questions in the database have been used
+    - Once all questions are exhausted, a new cycle starts automatically
     
-    # Shuffle both lists
-    rng.shuffle(unused_questions)
-    rng.shuffle(used_questions)
+    The active question bank is loaded once into an in-memory index and all
+    selection happens in memory; the result is deterministic for a date seed
+    and a given bank/tracker state.
+    
+    Returns:
+        {
+            'date': str (YYYY-MM-DD),
+            'quizzes': [
+                {
+                    'index': 0-10,
+                    'topic_ids': [ObjectId x 10],
+                    'question_ids': [[q1, q2, q3] x 10]  # Pre-selected questions
+                }
+            ],
+            'option_orders': {question_id: [order x MAX_ATTEMPTS]},
+            'generated_at': datetime
+        }
+    """
+    # Convert date to string for MongoDB storage
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    
+    # Load the active question bank once, with usage from the current cycle
+    cycle = get_usage_cycle()
+    bank, active_topics, image_quiz_topic_id = _load_pack_inputs(cycle)
+    total_active_questions = len(bank['question_ids'])
+    
+    # Select in memory; a new cycle is committed only once the pack is stored
+    available_unused = bank['used'].count(0)
+    selection = _plan_daily_pack(bank, active_topics, image_quiz_topic_id, pack_date)
+    start_new_cycle = selection['start_new_cycle']
+    if start_new_cycle:
+        print(f"🔄 Resetting question tracker. Used: {total_active_questions - available_unused}, Total: {total_active_questions}")
+    
+    quizzes = selection['quizzes']
+    newly_used_question_ids = [bank['question_ids'][o] for o in selection['selected_ordinals']]
+    pack_answer_keys = {
+        bank['question_ids'][o]: bank['correct_keys'][o] for o in selection['selected_ordinals']
+    }
+    total_used_after = bank['used'].count(1)
+    
+    # Create pack document
+    pack = {
+        'date': date_str,
+        'quizzes': quizzes,
+        'option_orders': _build_option_orders(date_str, newly_used_question_ids),
+        'generated_at': datetime.utcnow(),
+        'questions_used': len(newly_used_question_ids),
+        'total_used_after': total_used_after
+    }
     
-    # Prioritize unused questions
-    selected = []
+    # Store the pack first: if another generator won the race, its pack is
+    # the pack of the day and our selection must not touch the tracker
+    try:
+        result = daily_packs_col.insert_one(pack)
+    except DuplicateKeyError:
+        return serialize_doc(daily_packs_col.find_one({'date': date_str}))
+    pack['_id'] = result.inserted_id
     
-    # First, take from unused
-    for q in unused_questions:
-        if len(selected) >= 3:
-            break
-        selected.append(q)
+    # Mark the selected questions as used in this cycle
+    if start_new_cycle:
+        cycle = start_new_usage_cycle()
+    mark_questions_used(newly_used_question_ids, cycle)
+    _store_answer_keys(date_str, pack_answer_keys)
     
-    # If we still need more, take from used (fallback)
-    if len(selected) < 3:
-        for q in used_questions:
-            if len(selected) >= 3:
-                break
-            selected.append(q)
+    print(f"✅ Generated pack for {date_str}: {len(newly_used_question_ids)} new questions used, {total_used_after}/{total_active_questions} total used")
     
-    return selected
+    return serialize_doc(pack)
 
 
 def get_quiz_questions(topic_ids: List, attempt_num: int = 1, language: str = 'en', 
                        pack_date: date = None, quiz_index: int = None) -> List[Dict[str, Any]]:
     """
-    Get questions for multiple topics with randomized answer options.
-    Different randomization for each attempt.
-    Returns questions in specified language.
+    Get questions for multiple topics, with options in canonical A-D order.
+    Returns questions in specified language. Per-attempt option order is
+    applied on top with apply_option_order.
     
     Uses PRE-SELECTED questions from the daily pack to ensure no question repeats
     until all 1000 questions have been used.
     
     Args:
         topic_ids: List of topic IDs (10 topics)
-        attempt_num: Attempt number (for randomization seed)
+        attempt_num: Attempt number (unused; options are permuted by apply_option_order)
         language: 'en' or 'sk'
         pack_date: Date of the pack (to retrieve pre-selected questions)
         quiz_index: Index of the quiz in the pack
@@ -334,30 +741,43 @@ def get_quiz_questions(topic_ids: List, attempt_num: int = 1, language: str = 'e
     # Try to get pre-selected questions from pack
     pre_selected_questions = None
     if pack_date and quiz_index is not None:
-        date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
-        pack = daily_packs_col.find_one({'date': date_str})
+        pack = get_pack(pack_date)
         if pack and 'quizzes' in pack:
             for quiz in pack['quizzes']:
                 if quiz['index'] == quiz_index and 'question_ids' in quiz:
                     pre_selected_questions = quiz['question_ids']
                     break
-    
-    for topic_idx, topic_id in enumerate(topic_ids):
-        topic_oid = ObjectId(topic_id)
-        
+
+    # Batch-load all topics for this quiz in a single query
+    topic_oids = [ObjectId(topic_id) for topic_id in topic_ids]
+    topics_by_id = {
+        t['_id']: t for t in topics_col.find({'_id': {'$in': topic_oids}}, {'name': 1})
+    }
+
+    # Batch-load all pre-selected questions for this quiz in a single query
+    questions_by_id = {}
+    if pre_selected_questions:
+        all_question_oids = [ObjectId(q_id) for q_ids in pre_selected_questions for q_id in q_ids]
+        questions_by_id = {
+            q['_id']: q for q in questions_col.find({'_id': {'$in': all_question_oids}, 'active': True})
+        }
+
+    for topic_idx, topic_oid in enumerate(topic_oids):
+        topic_id = topic_ids[topic_idx]
+
         # Get topic info
-        topic = topics_col.find_one({'_id': topic_oid})
+        topic = topics_by_id.get(topic_oid)
         topic_name = topic['name'] if topic else 'Unknown'
-        
-        # Use pre-selected questions if available
+
+        # Use pre-selected questions if available (keeping the order from the pack)
         if pre_selected_questions and topic_idx < len(pre_selected_questions):
             question_ids = pre_selected_questions[topic_idx]
             questions = []
             for q_id in question_ids:
-                q = questions_col.find_one({'_id': ObjectId(q_id), 'active': True})
+                q = questions_by_id.get(ObjectId(q_id))
                 if q:
                     questions.append(q)
-            
+
             # If some pre-selected questions are missing, fall back to random selection
             if len(questions) < 3:
                 additional = list(questions_col.aggregate([
@@ -377,10 +797,6 @@ def get_quiz_questions(topic_ids: List, attempt_num: int = 1, language: str = 'e
         
         # Process each question
         for q in questions[:3]:
-            # Use question ID + attempt number as seed
-            seed = str(q['_id']) + str(attempt_num)
-            rng = random.Random(seed)
-            
             # Get text in specified language
             text = q['text']
             if isinstance(text, dict):
@@ -413,13 +829,302 @@ def get_quiz_questions(topic_ids: List, attempt_num: int = 1, language: str = 'e
     return all_questions
 
 
-def score_attempt(answers: List[Dict[str, str]]) -> Dict[str, Any]:
+# ============================================================================
+# PRERENDERED QUIZ PAYLOADS
+# ============================================================================
+# The questions of a quiz are fixed by the pack, so each (date, quiz, language)
+# is rendered once - localized text, options and topic names, without correct
+# keys - and stored in 'quiz_payloads'. Later requests read the stored payload
+# (or the process-local copy) and only apply per-user gating.
+
+_quiz_payload_cache: Dict[tuple, List[Dict[str, Any]]] = {}
+
+
+def _cache_quiz_payload(key: tuple, questions: List[Dict[str, Any]]) -> None:
+    _quiz_payload_cache[key] = questions
+    # Other threads write the cache concurrently: iterate over a snapshot
+    # of the keys (list() of a dict is atomic) and tolerate keys already gone
+    cached_keys = list(_quiz_payload_cache)
+    stale_dates = set(sorted({cached_key[0] for cached_key in cached_keys})[:-PACK_CACHE_DAYS])
+    for cached_key in cached_keys:
+        if cached_key[0] in stale_dates:
+            _quiz_payload_cache.pop(cached_key, None)
+
+
+def _payload_is_current(stored: Optional[Dict], pack: Dict[str, Any]) -> bool:
+    """Whether a stored payload was rendered from this pack (not a replaced one)"""
+    return stored is not None and stored.get('pack_id') == pack['_id']
+
+
+def get_quiz_payload(pack_date, quiz_index: int, language: str = 'en') -> List[Dict[str, Any]]:
     """
-    Score user answers against correct answers.
+    Get the ready-to-send questions of a quiz (no correct keys).
+    Rendered on first hit and then served from Mongo / local memory.
+    Callers must treat the returned list as read-only.
+    
+    Stored payloads carry the _id and generated_at of the pack they were
+    rendered from. A payload of another pack (e.g. rendered by a worker still
+    holding the pack from before a reset) is a miss; it is replaced by a
+    rendering from a newer pack, never by one from an older pack.
     
     Args:
-        answers: [{'question_id': str, 'choice_key': str}, ...]
+        pack_date: Date of the pack
+        quiz_index: Index of the quiz in the pack (0-10)
+        language: 'en' or 'sk'
+    
+    Returns:
+        List of 30 questions as returned by get_quiz_questions, minus 'correct_key'
+    
+    Raises:
+        ValueError: If there is no pack for the date
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    key = (date_str, quiz_index, language)
+    _sync_pack_cache_version()
+    
+    questions = _quiz_payload_cache.get(key)
+    if questions is not None:
+        return questions
+    
+    pack = get_pack(date_str)
+    if not pack:
+        raise ValueError(f"No pack for {date_str}")
+    
+    payload_key = {'date': date_str, 'quiz_index': quiz_index, 'lang': language}
+    stored = quiz_payloads_col.find_one(payload_key, {'questions': 1, 'pack_id': 1})
+    if _payload_is_current(stored, pack):
+        questions = stored['questions']
+    else:
+        topic_ids = pack['quizzes'][quiz_index]['topic_ids']
+        questions = get_quiz_questions(topic_ids, 1, language, pack_date=date_str, quiz_index=quiz_index)
+        for q in questions:
+            q.pop('correct_key', None)
+        
+        # First renderer of this pack wins; payloads of older packs are overwritten
+        try:
+            stored = quiz_payloads_col.find_one_and_update(
+                {
+                    **payload_key,
+                    '$or': [
+                        {'pack_generated_at': {'$lt': pack['generated_at']}},
+                        {'pack_generated_at': {'$exists': False}}
+                    ]
+                },
+                {'$set': {
+                    'pack_id': pack['_id'],
+                    'pack_generated_at': pack['generated_at'],
+                    'questions': questions,
+                    'question_ids': [q['_id'] for q in questions],
+                    'topic_ids': [str(topic_id) for topic_id in topic_ids],
+                    'created_at': datetime.utcnow()
+                }},
+                upsert=True,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            # Stored by a concurrent renderer, or from a newer pack than ours
+            stored = quiz_payloads_col.find_one(payload_key, {'questions': 1, 'pack_id': 1})
+        
+        if not _payload_is_current(stored, pack):
+            # Our pack was replaced in the meantime; serve this rendering
+            # uncached until the pack version sync drops the old pack
+            return questions
+        questions = stored['questions']
+    
+    _cache_quiz_payload(key, questions)
+    return questions
+
+
+def invalidate_quiz_payloads(question_id: Optional[str] = None, topic_id: Optional[str] = None,
+                             from_date: Optional[str] = None) -> int:
+    """
+    Delete stored quiz payloads and drop every worker's cached packs, payloads
+    and answer keys. Call after questions, topics or packs change.
+    
+    Args:
+        question_id: Only payloads containing this question
+        topic_id: Only payloads containing this topic
+        from_date: Only payloads for this date (YYYY-MM-DD) or later
+    
+    Returns:
+        Number of stored payloads deleted
+    """
+    query = {}
+    if question_id:
+        query['question_ids'] = question_id
+    if topic_id:
+        query['topic_ids'] = topic_id
+    if from_date:
+        query['date'] = {'$gte': from_date}
+    
+    deleted = quiz_payloads_col.delete_many(query).deleted_count
+    bump_pack_version()
+    return deleted
+
+
+# ============================================================================
+# PER-ATTEMPT OPTION ORDER
+# ============================================================================
+# Each pack stores, per question, one permutation of the option keys for each
+# of the MAX_ATTEMPTS attempts: {'option_orders': {question_id: ['CADB', ...]}}.
+# For attempt n, displayed option i ('A'..'D') shows canonical option
+# order[i]. Questions without an entry (older packs, fallback questions) keep
+# the canonical order.
+
+OPTION_KEYS = 'ABCD'
+
+
+def _build_option_orders(date_str: str, question_ids: List[str]) -> Dict[str, List[str]]:
+    """Deterministic option permutations for every question of a pack and every attempt"""
+    rng = random.Random(f'{date_str}:option-orders')
+    return {
+        q_id: [''.join(rng.sample(OPTION_KEYS, len(OPTION_KEYS))) for _ in range(MAX_ATTEMPTS)]
+        for q_id in question_ids
+    }
+
+
+def get_option_order(pack_date, question_id: str, attempt_num: int) -> str:
+    """Option order of a question for an attempt (canonical 'ABCD' if none stored)"""
+    return _pack_option_order(get_pack(pack_date), question_id, attempt_num)
+
+
+def _pack_option_order(pack: Optional[Dict], question_id: str, attempt_num: int) -> str:
+    orders = pack.get('option_orders', {}).get(question_id) if pack else None
+    if not orders or not 1 <= attempt_num <= len(orders):
+        return OPTION_KEYS
+    return orders[attempt_num - 1]
+
+
+def to_displayed_key(canonical_key: Optional[str], order: str) -> Optional[str]:
+    """Map a canonical option key to the key it is displayed under"""
+    if canonical_key in (None, 'UNANSWERED') or canonical_key not in order:
+        return canonical_key
+    return OPTION_KEYS[order.index(canonical_key)]
+
+
+def to_canonical_key(displayed_key: str, order: str) -> str:
+    """Map a displayed option key back to the canonical key"""
+    if displayed_key not in OPTION_KEYS:
+        return displayed_key  # 'UNANSWERED'
+    return order[OPTION_KEYS.index(displayed_key)]
+
+
+def apply_option_order(question: Dict[str, Any], order: str) -> Dict[str, Any]:
+    """
+    Return a copy of a rendered question with its options in the given order,
+    relabeled A-D. A 'correct_key' on the question is mapped along.
+    """
+    if order == OPTION_KEYS:
+        return dict(question)
+    
+    by_key = {opt['key']: opt for opt in question['options']}
+    displayed = dict(question)
+    displayed['options'] = [
+        {**by_key[canonical_key], 'key': OPTION_KEYS[i]}
+        for i, canonical_key in enumerate(order)
+    ]
+    if 'correct_key' in question:
+        displayed['correct_key'] = to_displayed_key(question['correct_key'], order)
+    return displayed
+
+
+def get_quiz_for_attempt(pack_date, quiz_index: int, language: str,
+                         attempt_num: int) -> List[Dict[str, Any]]:
+    """
+    Get the prerendered questions of a quiz with the option order of an attempt.
+    
+    Returns:
+        List of 30 questions (no correct keys), options relabeled A-D
+    """
+    questions = get_quiz_payload(pack_date, quiz_index, language)
+    return [
+        apply_option_order(q, get_option_order(pack_date, q['_id'], attempt_num))
+        for q in questions
+    ]
+
+
+def map_displayed_answers(answers: List[Dict[str, str]], pack_date,
+                          attempt_num: int) -> List[Dict[str, str]]:
+    """
+    Convert submitted answers (displayed keys of an attempt) to canonical keys.
+    
+    Returns:
+        [{'question_id': str, 'choice_key': canonical key}, ...]
+    """
+    return [
+        {
+            **ans,
+            'choice_key': to_canonical_key(
+                ans['choice_key'],
+                get_option_order(pack_date, ans['question_id'], attempt_num)
+            )
+        }
+        for ans in answers
+    ]
+
+
+# ============================================================================
+# ANSWER-KEY CACHE
+# ============================================================================
+
+# Per-day answer keys for every question in the day's pack:
+# {date_str: {question_id: correct_key}}
+_answer_key_cache: Dict[str, Dict[str, str]] = {}
+ANSWER_KEY_CACHE_DAYS = 3  # Keep yesterday/today/tomorrow around midnight
+
+
+def _store_answer_keys(date_str: str, answer_keys: Dict[str, str]) -> None:
+    """Cache the answer keys of a pack, evicting the oldest days beyond the limit"""
+    _answer_key_cache[date_str] = answer_keys
+    for stale_date in sorted(_answer_key_cache)[:-ANSWER_KEY_CACHE_DAYS]:
+        _answer_key_cache.pop(stale_date, None)
+
+
+def get_pack_answer_keys(pack_date) -> Dict[str, str]:
+    """
+    Get question_id -> correct_key for all questions in the day's pack.
+    Built once per day (on generation or first read) and served from memory.
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    _sync_pack_cache_version()
+    
+    answer_keys = _answer_key_cache.get(date_str)
+    if answer_keys is not None:
+        return answer_keys
+    
+    pack = get_pack(date_str)
+    if not pack:
+        return {}
+    
+    question_oids = [
+        ObjectId(q_id)
+        for quiz in pack.get('quizzes', [])
+        for q_ids in quiz.get('question_ids', [])
+        for q_id in q_ids
+    ]
+    answer_keys = {
+        str(q['_id']): q['correct_key']
+        for q in questions_col.find({'_id': {'$in': question_oids}}, {'correct_key': 1})
+    }
+    _store_answer_keys(date_str, answer_keys)
+    return answer_keys
+
+
+def score_attempt(answers: List[Dict[str, str]], pack_date=None,
+                  attempt_num: Optional[int] = None) -> Dict[str, Any]:
+    """
+    Score user answers against correct answers.
+    
+    When pack_date is given, correct keys come from the in-memory answer-key
+    cache of that day's pack; only questions outside the pack (e.g. random
+    fallback questions) are looked up in the database, in a single query.
+    
+    Args:
+        answers: [{'question_id': str, 'choice_key': str}, ...]
                  choice_key can be 'UNANSWERED' if time expired
+        pack_date: Optional date of the pack the answers belong to
+        attempt_num: If given (with pack_date), choice keys are the displayed
+                     keys of that attempt and are mapped to canonical keys
     
     Returns:
         {
@@ -432,16 +1137,30 @@ def score_attempt(answers: List[Dict[str, str]]) -> Dict[str, Any]:
     details = []
     correct_count = 0
     
+    if pack_date and attempt_num:
+        answers = map_displayed_answers(answers, pack_date, attempt_num)
+    
+    answer_keys = get_pack_answer_keys(pack_date) if pack_date else {}
+    
+    # Resolve any questions not covered by the cache with one batched query
+    missing_oids = [
+        ObjectId(ans['question_id']) for ans in answers
+        if ans['question_id'] not in answer_keys
+    ]
+    if missing_oids:
+        answer_keys = dict(answer_keys)
+        for q in questions_col.find({'_id': {'$in': missing_oids}}, {'correct_key': 1}):
+            answer_keys[str(q['_id'])] = q['correct_key']
+    
     for ans in answers:
-        q_id = ObjectId(ans['question_id'])
-        question = questions_col.find_one({'_id': q_id})
+        correct_key = answer_keys.get(ans['question_id'])
         
-        if not question:
+        if correct_key is None:
             continue
         
         # Check if answered and correct
         is_correct = (ans['choice_key'] != 'UNANSWERED' and 
-                     ans['choice_key'] == question['correct_key'])
+                     ans['choice_key'] == correct_key)
         if is_correct:
             correct_count += 1
         
@@ -462,10 +1181,28 @@ def score_attempt(answers: List[Dict[str, str]]) -> Dict[str, Any]:
 
 
 def record_attempt(user_id: str, pack_date: date, quiz_index: int, 
-                   attempt_num: int, answers: List[Dict], time_ms: int) -> Dict[str, Any]:
+                   attempt_num: int, answers: List[Dict], time_ms: int,
+                   nickname: Optional[str] = None,
+                   slot_reserved: bool = False,
+                   displayed_keys: bool = False,
+                   post_submit: bool = False) -> Dict[str, Any]:
     """
     Record quiz attempt and update best result if needed.
     
+    Args:
+        answers: [{'question_id': str, 'choice_key': str}, ...] with canonical
+                 option keys (stored as given)
+        nickname: Optional player nickname for the leaderboard entry
+                  (looked up from the user document when not given)
+        slot_reserved: True if the attempt was already counted by
+                       reserve_attempt_slot (otherwise it is counted here)
+        displayed_keys: True if choice keys are the displayed keys of
+                        attempt_num's option order (mapped to canonical keys
+                        before scoring and storing)
+        post_submit: True to mark the attempt as pending post-submit
+                     processing, in the same write (the outbox sweeper picks
+                     it up if the event is never enqueued)
+    
     Returns:
         {
             'attempt_id': str,
@@ -476,8 +1213,10 @@ def record_attempt(user_id: str, pack_date: date, quiz_index: int,
     # Convert date to string for MongoDB storage
     date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
     
-    # Score the attempt
-    score = score_attempt(answers)
+    # Store and score canonical keys
+    if displayed_keys:
+        answers = map_displayed_answers(answers, date_str, attempt_num)
+    score = score_attempt(answers, pack_date=date_str)
     
     # Save attempt record
     attempt_doc = {
@@ -491,13 +1230,27 @@ def record_attempt(user_id: str, pack_date: date, quiz_index: int,
         'percentage': score['percentage'],
         'finished_at': datetime.utcnow()
     }
+    if post_submit:
+        attempt_doc['post_submit_pending'] = True
     
     result = attempts_col.insert_one(attempt_doc)
     attempt_id = str(result.inserted_id)
     
     # Update best result
     is_best = upsert_best_result(user_id, date_str, quiz_index, 
-                                   score['percentage'], time_ms)
+                                   score['percentage'], time_ms, nickname=nickname)
+    
+    # Count the attempt in the user's daily state unless it was reserved up front
+    if not slot_reserved:
+        _retry_on_duplicate(
+            user_daily_state_col.update_one,
+            {'user_id': ObjectId(user_id), 'date': date_str},
+            {
+                '$inc': {f'slots.{quiz_index}.attempts': 1},
+                '$set': {'updated_at': datetime.utcnow()}
+            },
+            upsert=True
+        )
     
     return {
         'attempt_id': attempt_id,
@@ -506,14 +1259,61 @@ def record_attempt(user_id: str, pack_date: date, quiz_index: int,
     }
 
 
+def _retry_on_duplicate(operation, *args, **kwargs):
+    """
+    Run an upsert, retrying once on DuplicateKeyError: a concurrent first
+    insert for the same key loses on the unique index, and the retry then
+    takes the update path.
+    """
+    try:
+        return operation(*args, **kwargs)
+    except DuplicateKeyError:
+        return operation(*args, **kwargs)
+
+
+def _keep_best_pipeline(percentage: float, time_ms: int, prefix: str = '',
+                        extra_set: Optional[Dict[str, Any]] = None) -> List[Dict]:
+    """
+    Build an update pipeline that replaces the best score stored under
+    `prefix` only when (percentage, -time_ms) is lexicographically better.
+    Runs server-side, so concurrent writers can never regress a best score.
+    """
+    pct_field = f'{prefix}best_pct'
+    time_field = f'{prefix}best_time_ms'
+    is_better = {'$or': [
+        {'$eq': [{'$type': f'${pct_field}'}, 'missing']},
+        {'$gt': [percentage, f'${pct_field}']},
+        {'$and': [
+            {'$eq': [percentage, f'${pct_field}']},
+            {'$lt': [time_ms, f'${time_field}']}
+        ]}
+    ]}
+    return [
+        {'$set': {'_is_better': is_better}},
+        {'$set': {
+            pct_field: {'$cond': ['$_is_better', percentage, f'${pct_field}']},
+            time_field: {'$cond': ['$_is_better', time_ms, f'${time_field}']},
+            **(extra_set or {})
+        }},
+        {'$unset': '_is_better'}
+    ]
+
+
 def upsert_best_result(user_id: str, pack_date, quiz_index: int,
-                       percentage: float, time_ms: int) -> bool:
+                       percentage: float, time_ms: int,
+                       nickname: Optional[str] = None) -> bool:
     """
     Update best result for user/date/quiz if current is better.
     Better = higher percentage, or same percentage but faster time.
     
+    The comparison and write happen in one atomic upsert (one round-trip,
+    no read-modify-write). A new best is then written to the materialized
+    leaderboard and the user's daily state, and applied as a delta to the
+    user's daily totals.
+    
     Args:
         pack_date: date object or string (YYYY-MM-DD)
+        nickname: Optional nickname to denormalize into the leaderboards
     
     Returns:
         True if this is the new best result
@@ -522,43 +1322,521 @@ def upsert_best_result(user_id: str, pack_date, quiz_index: int,
     date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
     user_oid = ObjectId(user_id)
     
-    existing = results_col.find_one({
-        'user_id': user_oid,
-        'date': date_str,
-        'quiz_index': quiz_index
+    pipeline = _keep_best_pipeline(percentage, time_ms, extra_set={
+        'locked_after_answers': {'$ifNull': ['$locked_after_answers', False]},
+        'updated_at': datetime.utcnow()
     })
     
-    is_best = False
+    # Returns the document as it was before the update (None if newly inserted)
+    previous = _retry_on_duplicate(
+        results_col.find_one_and_update,
+        {'user_id': user_oid, 'date': date_str, 'quiz_index': quiz_index},
+        pipeline,
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
     
-    if not existing:
-        # First attempt - always best
-        results_col.insert_one({
-            'user_id': user_oid,
+    had_score = previous is not None and 'best_pct' in previous
+    is_best = (not had_score or percentage > previous['best_pct'] or
+               (percentage == previous['best_pct'] and time_ms < previous['best_time_ms']))
+    
+    if is_best:
+        if nickname is None:
+            user = users_col.find_one({'_id': user_oid}, {'nickname': 1})
+            nickname = user['nickname'] if user else 'Unknown'
+        
+        _update_leaderboard_entry(user_oid, date_str, quiz_index,
+                                  percentage, time_ms, nickname)
+        
+        _retry_on_duplicate(
+            user_daily_state_col.update_one,
+            {'user_id': user_oid, 'date': date_str},
+            _keep_best_pipeline(percentage, time_ms, prefix=f'slots.{quiz_index}.'),
+            upsert=True
+        )
+        
+        _update_daily_totals(user_oid, date_str, quiz_index,
+                             percentage, time_ms, nickname)
+    
+    return is_best
+
+
+# ============================================================================
+# MATERIALIZED LEADERBOARDS
+# ============================================================================
+# Per-quiz: one 'leaderboards' document per (date, quiz_index, user_id),
+# ordered by best_pct DESC, best_time_ms ASC, user_id ASC.
+# Daily overall: one 'daily_totals' document per (user_id, date),
+# ordered by avg_pct DESC, total_time_ms ASC, user_id ASC.
+# Nicknames are denormalized into both; user_id breaks ties so that keyset
+# pagination and rank counts are stable.
+
+LEADERBOARD_SORT = [
+    ('best_pct', DESCENDING),
+    ('best_time_ms', ASCENDING),
+    ('user_id', ASCENDING)
+]
+
+DAILY_TOTALS_SORT = [
+    ('avg_pct', DESCENDING),
+    ('total_time_ms', ASCENDING),
+    ('user_id', ASCENDING)
+]
+
+
+def _update_leaderboard_entry(user_oid: ObjectId, date_str: str, quiz_index: int,
+                              percentage: float, time_ms: int, nickname: str) -> None:
+    """Write a user's new best score into the materialized quiz leaderboard"""
+    _retry_on_duplicate(
+        leaderboard_col.update_one,
+        {
             'date': date_str,
             'quiz_index': quiz_index,
-            'best_pct': percentage,
-            'best_time_ms': time_ms,
-            'locked_after_answers': False,
+            'user_id': user_oid
+        },
+        _keep_best_pipeline(percentage, time_ms, extra_set={
+            'nickname': {'$literal': nickname},
             'updated_at': datetime.utcnow()
-        })
-        is_best = True
-    else:
-        # Check if current is better
-        if (percentage > existing['best_pct'] or 
-            (percentage == existing['best_pct'] and time_ms < existing['best_time_ms'])):
-            results_col.update_one(
-                {'_id': existing['_id']},
-                {
-                    '$set': {
-                        'best_pct': percentage,
-                        'best_time_ms': time_ms,
-                        'updated_at': datetime.utcnow()
-                    }
-                }
+        }),
+        upsert=True
+    )
+
+
+def _merge_daily_totals(user_oid: ObjectId, date_str: str, nickname: str,
+                        bests: Dict[int, tuple]) -> Optional[Dict[str, Any]]:
+    """
+    Atomically merge per-quiz best scores into the user's daily totals.
+    
+    The document keeps each quiz's best under 'quizzes.<quiz_index>' and its
+    sums and average are recomputed from those in the same update, so merges
+    are keep-best and order-independent: replaying or racing them can never
+    double-count a quiz.
+    
+    Args:
+        bests: {quiz_index: (percentage, time_ms)}
+    
+    Returns:
+        The document as it was before the update (None if newly inserted)
+    """
+    pipeline = []
+    for quiz_index, (percentage, time_ms) in bests.items():
+        pipeline += _keep_best_pipeline(percentage, time_ms, prefix=f'quizzes.{quiz_index}.')
+    pipeline += [
+        {'$set': {'_quizzes': {'$objectToArray': {'$ifNull': ['$quizzes', {}]}}}},
+        {'$set': {
+            'nickname': {'$literal': nickname},
+            'total_pct': {'$sum': '$_quizzes.v.best_pct'},
+            'total_time_ms': {'$sum': '$_quizzes.v.best_time_ms'},
+            'quizzes_completed': {'$size': '$_quizzes'},
+            'updated_at': datetime.utcnow()
+        }},
+        {'$set': {
+            'avg_pct': {'$divide': ['$total_pct', {'$max': ['$quizzes_completed', 1]}]}
+        }},
+        {'$unset': '_quizzes'}
+    ]
+    return _retry_on_duplicate(
+        daily_totals_col.find_one_and_update,
+        {'user_id': user_oid, 'date': date_str},
+        pipeline,
+        upsert=True,
+        return_document=ReturnDocument.BEFORE
+    )
+
+
+def _update_daily_totals(user_oid: ObjectId, date_str: str, quiz_index: int,
+                         percentage: float, time_ms: int, nickname: str) -> None:
+    """
+    Merge a user's new best score into their daily totals.
+    A document that did not exist yet, or predates the per-quiz map, may be
+    missing the user's other quizzes of the day: merge them in from results.
+    """
+    previous = _merge_daily_totals(user_oid, date_str, nickname,
+                                   {quiz_index: (percentage, time_ms)})
+    if previous is None or 'quizzes' not in previous:
+        bests = {
+            r['quiz_index']: (r['best_pct'], r['best_time_ms'])
+            for r in results_col.find(
+                {'user_id': user_oid, 'date': date_str, 'best_pct': {'$exists': True}},
+                {'quiz_index': 1, 'best_pct': 1, 'best_time_ms': 1}
             )
-            is_best = True
+        }
+        if bests:
+            _merge_daily_totals(user_oid, date_str, nickname, bests)
+
+
+def _encode_cursor(rank: int, pct: float, time_ms: int, user_id) -> str:
+    """Encode a ranking position as an opaque cursor"""
+    payload = {
+        'rank': rank,
+        'pct': pct,
+        'time_ms': time_ms,
+        'user_id': str(user_id)
+    }
+    return base64.urlsafe_b64encode(json.dumps(payload).encode('utf-8')).decode('ascii')
+
+
+def _decode_cursor(cursor: str) -> Dict[str, Any]:
+    """Decode a cursor produced by _encode_cursor. Raises ValueError if invalid."""
+    try:
+        payload = json.loads(base64.urlsafe_b64decode(cursor.encode('ascii')))
+        return {
+            'rank': int(payload['rank']),
+            'pct': float(payload['pct']),
+            'time_ms': int(payload['time_ms']),
+            'user_id': ObjectId(payload['user_id'])
+        }
+    except Exception:
+        raise ValueError("Invalid leaderboard cursor")
+
+
+def _group_member_filter(group_id: Optional[str]) -> Dict[str, Any]:
+    """Build a user_id filter restricting results to the members of a group"""
+    if group_id:
+        group = groups_col.find_one({'_id': ObjectId(group_id)}, {'members': 1})
+        if group and 'members' in group:
+            return {'user_id': {'$in': group['members']}}
+    return {}
+
+
+def _ranked_before_filter(sort: List, pct: float, time_ms: int,
+                          user_oid: ObjectId) -> Dict[str, Any]:
+    """Filter matching entries ranked strictly before the given position in `sort`"""
+    pct_field, time_field = sort[0][0], sort[1][0]
+    return {'$or': [
+        {pct_field: {'$gt': pct}},
+        {pct_field: pct, time_field: {'$lt': time_ms}},
+        {pct_field: pct, time_field: time_ms, 'user_id': {'$lt': user_oid}}
+    ]}
+
+
+def _ranked_after_filter(sort: List, pct: float, time_ms: int,
+                         user_oid: ObjectId) -> Dict[str, Any]:
+    """Filter matching entries ranked strictly after the given position in `sort`"""
+    pct_field, time_field = sort[0][0], sort[1][0]
+    return {'$or': [
+        {pct_field: {'$lt': pct}},
+        {pct_field: pct, time_field: {'$gt': time_ms}},
+        {pct_field: pct, time_field: time_ms, 'user_id': {'$gt': user_oid}}
+    ]}
+
+
+def _leaderboard_row(rank: int, entry: Dict) -> Dict[str, Any]:
+    return {
+        'rank': rank,
+        'user_id': str(entry['user_id']),
+        'nickname': entry.get('nickname', 'Unknown'),
+        'percentage': entry['best_pct'],
+        'time_ms': entry['best_time_ms']
+    }
+
+
+def _daily_ranking_row(rank: int, entry: Dict) -> Dict[str, Any]:
+    return {
+        'rank': rank,
+        'user_id': str(entry['user_id']),
+        'nickname': entry.get('nickname', 'Unknown'),
+        'quizzes_completed': entry['quizzes_completed'],
+        'avg_percentage': round(entry['avg_pct'], 2),
+        'total_percentage': round(entry['total_pct'], 2),
+        'total_time_ms': entry['total_time_ms']
+    }
+
+
+def _ranking_page(collection, sort: List, base_query: Dict, row_builder,
+                  limit: int, cursor: Optional[str]) -> Dict[str, Any]:
+    """Read one keyset-paginated page of a materialized ranking"""
+    query, rank_offset = _ranking_page_query(sort, base_query, cursor)
+    
+    # Fetch one extra entry to know whether another page exists
+    entries = list(collection.find(query).sort(sort).limit(limit + 1))
+    return _ranking_page_result(sort, row_builder, entries, limit, rank_offset)
+
+
+def _ranking_page_query(sort: List, base_query: Dict, cursor: Optional[str]):
+    """Query and rank offset of the page after `cursor`"""
+    query = dict(base_query)
+    
+    rank_offset = 0
+    if cursor:
+        after = _decode_cursor(cursor)
+        rank_offset = after['rank']
+        query.update(_ranked_after_filter(sort, after['pct'], after['time_ms'], after['user_id']))
+    return query, rank_offset
+
+
+def _ranking_page_result(sort: List, row_builder, entries: List[Dict],
+                         limit: int, rank_offset: int) -> Dict[str, Any]:
+    """Build a page from up to limit + 1 entries read after the cursor"""
+    page = entries[:limit]
     
-    return is_best
+    next_cursor = None
+    if len(entries) > limit:
+        last = page[-1]
+        next_cursor = _encode_cursor(rank_offset + len(page), last[sort[0][0]],
+                                     last[sort[1][0]], last['user_id'])
+    
+    return {
+        'leaderboard': [row_builder(rank_offset + idx + 1, e) for idx, e in enumerate(page)],
+        'next_cursor': next_cursor
+    }
+
+
+def _ranking_window(collection, sort: List, base_query: Dict, row_builder,
+                    user_oid: ObjectId, radius: int) -> Dict[str, Any]:
+    """
+    Read a user's rank and up to `radius` neighbours on either side of a
+    materialized ranking: one indexed count plus two O(radius) range scans.
+    """
+    entry = collection.find_one({**base_query, 'user_id': user_oid})
+    if not entry:
+        return {'rank': None, 'leaderboard': []}
+    
+    pct, time_ms = entry[sort[0][0]], entry[sort[1][0]]
+    before = _ranked_before_filter(sort, pct, time_ms, user_oid)
+    after = _ranked_after_filter(sort, pct, time_ms, user_oid)
+    
+    rank = collection.count_documents({**base_query, **before}) + 1
+    
+    reverse_sort = [(field, -direction) for field, direction in sort]
+    above = list(collection.find({**base_query, **before}).sort(reverse_sort).limit(radius))
+    above.reverse()
+    below = list(collection.find({**base_query, **after}).sort(sort).limit(radius))
+    
+    first_rank = rank - len(above)
+    window = above + [entry] + below
+    
+    return {
+        'rank': rank,
+        'leaderboard': [row_builder(first_rank + idx, e) for idx, e in enumerate(window)]
+    }
+
+
+def get_user_rank(user_id: str, pack_date, quiz_index: int,
+                  group_id: Optional[str] = None) -> Optional[int]:
+    """
+    Get a user's rank on a quiz leaderboard without materializing it.
+    Rank = 1 + number of entries ranked strictly better, counted on the
+    (date, quiz_index, best_pct, best_time_ms, user_id) index.
+    
+    Returns:
+        The rank (1-based), or None if the user has no result for the quiz
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    ensure_leaderboard_materialized(date_str, quiz_index)
+    user_oid = ObjectId(user_id)
+    
+    entry = leaderboard_col.find_one({
+        'date': date_str,
+        'quiz_index': quiz_index,
+        'user_id': user_oid
+    })
+    if not entry:
+        return None
+    
+    better_count = leaderboard_col.count_documents({
+        'date': date_str,
+        'quiz_index': quiz_index,
+        **_group_member_filter(group_id),
+        **_ranked_before_filter(LEADERBOARD_SORT, entry['best_pct'], entry['best_time_ms'], user_oid)
+    })
+    
+    return better_count + 1
+
+
+def get_leaderboard_page(pack_date, quiz_index: int, limit: int = 100,
+                         cursor: Optional[str] = None,
+                         group_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get one page of the leaderboard for a quiz from the materialized store.
+    Uses keyset pagination, so a page costs O(limit) regardless of player count.
+    
+    Args:
+        pack_date: date object or string (YYYY-MM-DD)
+        quiz_index: Quiz index (0-9 for regular, 10 for bonus)
+        limit: Page size
+        cursor: Opaque cursor returned as 'next_cursor' by the previous page
+        group_id: Optional group filter
+    
+    Returns:
+        {
+            'leaderboard': [{'rank', 'user_id', 'nickname', 'percentage', 'time_ms'}, ...],
+            'next_cursor': str or None
+        }
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    ensure_leaderboard_materialized(date_str, quiz_index)
+    
+    base_query = {
+        'date': date_str,
+        'quiz_index': quiz_index,
+        **_group_member_filter(group_id)
+    }
+    
+    return _ranking_page(leaderboard_col, LEADERBOARD_SORT, base_query,
+                         _leaderboard_row, limit, cursor)
+
+
+def get_leaderboard_around_user(user_id: str, pack_date, quiz_index: int,
+                                radius: int = 5,
+                                group_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get the user's rank and up to `radius` neighbours on either side.
+    Neighbours are read with two small index range scans, so the cost is
+    O(radius) regardless of how many players the quiz has.
+    
+    Returns:
+        {
+            'rank': int or None (None if the user has no result),
+            'leaderboard': [{'rank', 'user_id', 'nickname', 'percentage', 'time_ms'}, ...]
+        }
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    ensure_leaderboard_materialized(date_str, quiz_index)
+    
+    base_query = {
+        'date': date_str,
+        'quiz_index': quiz_index,
+        **_group_member_filter(group_id)
+    }
+    
+    return _ranking_window(leaderboard_col, LEADERBOARD_SORT, base_query,
+                           _leaderboard_row, ObjectId(user_id), radius)
+
+
+def get_daily_ranking_page(pack_date, limit: int = 100,
+                           cursor: Optional[str] = None,
+                           group_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get one page of the overall daily ranking from the daily_totals collection.
+    Ranking: average percentage DESC, then total time ASC.
+    
+    Returns:
+        {
+            'leaderboard': [{'rank', 'user_id', 'nickname', 'quizzes_completed',
+                             'avg_percentage', 'total_percentage', 'total_time_ms'}, ...],
+            'next_cursor': str or None
+        }
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    ensure_leaderboard_materialized(date_str)
+    
+    base_query = {
+        'date': date_str,
+        **_group_member_filter(group_id)
+    }
+    
+    return _ranking_page(daily_totals_col, DAILY_TOTALS_SORT, base_query,
+                         _daily_ranking_row, limit, cursor)
+
+
+def get_daily_ranking_around_user(user_id: str, pack_date, radius: int = 5,
+                                  group_id: Optional[str] = None) -> Dict[str, Any]:
+    """
+    Get the user's overall daily rank and up to `radius` neighbours on either side.
+    Ranking: average percentage DESC, then total time ASC.
+    
+    Returns:
+        {
+            'rank': int or None (None if the user has not played today),
+            'leaderboard': [{'rank', 'user_id', 'nickname', 'quizzes_completed',
+                             'avg_percentage', 'total_percentage', 'total_time_ms'}, ...]
+        }
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    ensure_leaderboard_materialized(date_str)
+    
+    base_query = {
+        'date': date_str,
+        **_group_member_filter(group_id)
+    }
+    
+    return _ranking_window(daily_totals_col, DAILY_TOTALS_SORT, base_query,
+                           _daily_ranking_row, ObjectId(user_id), radius)
+
+
+def rebuild_leaderboard(pack_date, quiz_index: Optional[int] = None) -> int:
+    """
+    Rebuild the materialized leaderboards for a date from the results collection.
+    Used to backfill days recorded before the leaderboard store existed.
+    Daily totals are rebuilt whole for the date, regardless of quiz_index.
+    
+    Returns:
+        Number of quiz leaderboard entries written
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    
+    query = {'date': date_str, 'best_pct': {'$exists': True}}
+    results = list(results_col.find(query))
+    user_oids = list({r['user_id'] for r in results})
+    nicknames = {
+        u['_id']: u.get('nickname', 'Unknown')
+        for u in users_col.find({'_id': {'$in': user_oids}}, {'nickname': 1})
+    }
+    
+    written = 0
+    totals = {}
+    for result in results:
+        nickname = nicknames.get(result['user_id'], 'Unknown')
+        if quiz_index is None or result['quiz_index'] == quiz_index:
+            _update_leaderboard_entry(
+                result['user_id'], date_str, result['quiz_index'],
+                result['best_pct'], result['best_time_ms'], nickname
+            )
+            written += 1
+        
+        totals.setdefault(result['user_id'], {})[result['quiz_index']] = (
+            result['best_pct'], result['best_time_ms']
+        )
+    
+    for user_oid, bests in totals.items():
+        _merge_daily_totals(user_oid, date_str, nicknames.get(user_oid, 'Unknown'), bests)
+    
+    return written
+
+
+# (date, quiz_index) boards (quiz_index None: daily totals) known to be materialized
+_materialized_boards: set = set()
+MATERIALIZED_BOARDS_MAX = 1024
+
+
+def ensure_leaderboard_materialized(pack_date, quiz_index: Optional[int] = None) -> bool:
+    """
+    Backfill a board from results if the store has fewer rows than there are
+    players with results (days played before the store existed, a deploy in
+    the middle of a day, rows lost to a failed write). Checked once per board
+    and process; the rebuild is keep-best, so it never regresses a row.
+    
+    Args:
+        quiz_index: Quiz leaderboard to check, or None for the daily totals
+    
+    Returns:
+        True if the board was rebuilt
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    board = (date_str, quiz_index)
+    if board in _materialized_boards:
+        return False
+    
+    if quiz_index is None:
+        store, query = daily_totals_col, {'date': date_str}
+        played = len(results_col.distinct('user_id', {**query, 'best_pct': {'$exists': True}}))
+    else:
+        store, query = leaderboard_col, {'date': date_str, 'quiz_index': quiz_index}
+        played = results_col.count_documents({**query, 'best_pct': {'$exists': True}})
+    
+    if not played:
+        return False  # Nothing played yet; submits write the store themselves
+    
+    rebuilt = False
+    if store.count_documents(query) < played:
+        rebuild_leaderboard(date_str, quiz_index)
+        rebuilt = True
+    
+    if len(_materialized_boards) >= MATERIALIZED_BOARDS_MAX:
+        _materialized_boards.clear()
+    _materialized_boards.add(board)
+    return rebuilt
 
 
 def compute_leaderboard(pack_date, quiz_index: int, 
@@ -586,38 +1864,18 @@ def compute_leaderboard(pack_date, quiz_index: int,
     # Convert date to string if needed
     date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
     
-    # Build query filter
+    # Build query filter (optionally restricted to group members)
     query = {
         'date': date_str,
-        'quiz_index': quiz_index
+        'quiz_index': quiz_index,
+        **_group_member_filter(group_id)
     }
     
-    # Filter by group members if group_id provided
-    if group_id:
-        group = groups_col.find_one({'_id': ObjectId(group_id)})
-        if group and 'members' in group:
-            query['user_id'] = {'$in': group['members']}
-    
-    # Get results sorted by percentage DESC, time ASC
-    results = list(results_col.find(query).sort([
-        ('best_pct', DESCENDING),
-        ('best_time_ms', ASCENDING)
-    ]))
-    
-    # Build leaderboard with user info
-    leaderboard = []
-    for idx, result in enumerate(results):
-        user = users_col.find_one({'_id': result['user_id']})
-        
-        leaderboard.append({
-            'rank': idx + 1,
-            'user_id': str(result['user_id']),
-            'nickname': user['nickname'] if user else 'Unknown',
-            'percentage': result['best_pct'],
-            'time_ms': result['best_time_ms']
-        })
+    # Read the materialized leaderboard (nicknames are denormalized into it)
+    ensure_leaderboard_materialized(date_str, quiz_index)
+    entries = leaderboard_col.find(query).sort(LEADERBOARD_SORT)
     
-    return leaderboard
+    return [_leaderboard_row(idx + 1, entry) for idx, entry in enumerate(entries)]
 
 
 def lock_quiz_after_answers(user_id: str, pack_date, quiz_index: int) -> bool:
@@ -635,7 +1893,8 @@ def lock_quiz_after_answers(user_id: str, pack_date, quiz_index: int) -> bool:
     date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
     user_oid = ObjectId(user_id)
     
-    result = results_col.update_one(
+    result = _retry_on_duplicate(
+        results_col.update_one,
         {
             'user_id': user_oid,
             'date': date_str,
@@ -650,71 +1909,293 @@ def lock_quiz_after_answers(user_id: str, pack_date, quiz_index: int) -> bool:
         upsert=True
     )
     
+    _retry_on_duplicate(
+        user_daily_state_col.update_one,
+        {'user_id': user_oid, 'date': date_str},
+        {'$set': {f'slots.{quiz_index}.locked': True, 'updated_at': datetime.utcnow()}},
+        upsert=True
+    )
+    
     return result.modified_count > 0 or result.upserted_id is not None
 
 
+# ============================================================================
+# USER DAILY STATE
+# ============================================================================
+# One document per (user_id, date) holding, for each of the 11 quiz slots,
+# the attempt count, the lock flag and the best score:
+#   {'user_id', 'date', 'backfilled': True, 'slots': {'0': {'attempts', 'locked', 'best_pct', 'best_time_ms'}, ...}}
+# Maintained by record_attempt and lock_quiz_after_answers, so the dashboard
+# and all gate checks are served by a single read. Attempt slots are only
+# reserved on backfilled documents, so a reservation never races the backfill.
+
+def _build_daily_state_slots(user_oid: ObjectId, date_str: str) -> Dict[str, Dict]:
+    """Rebuild state slots from attempts/results (days played before the state document existed)"""
+    slots = {}
+    
+    for row in attempts_col.aggregate([
+        {'$match': {'user_id': user_oid, 'date': date_str}},
+        {'$group': {'_id': '$quiz_index', 'attempts': {'$sum': 1}}}
+    ]):
+        slots.setdefault(str(row['_id']), {})['attempts'] = row['attempts']
+    
+    for result in results_col.find({'user_id': user_oid, 'date': date_str}):
+        slot = slots.setdefault(str(result['quiz_index']), {})
+        if result.get('locked_after_answers'):
+            slot['locked'] = True
+        if 'best_pct' in result:
+            slot['best_pct'] = result['best_pct']
+            slot['best_time_ms'] = result['best_time_ms']
+    
+    return slots
+
+
+def _backfill_daily_state(user_oid: ObjectId, date_str: str) -> Dict[str, Any]:
+    """
+    Merge the slots rebuilt from attempts/results into the state document in
+    one atomic upsert and mark it backfilled. Counters already on the document
+    (e.g. from a concurrent record_attempt) are kept: attempts take the max,
+    locks are OR-ed and the best score is kept.
+    """
+    pipeline = []
+    for quiz_index, slot in _build_daily_state_slots(user_oid, date_str).items():
+        prefix = f'slots.{quiz_index}.'
+        merged = {}
+        if 'attempts' in slot:
+            merged[f'{prefix}attempts'] = {
+                '$max': [{'$ifNull': [f'${prefix}attempts', 0]}, slot['attempts']]
+            }
+        if slot.get('locked'):
+            merged[f'{prefix}locked'] = True
+        if merged:
+            pipeline.append({'$set': merged})
+        if 'best_pct' in slot:
+            pipeline.extend(_keep_best_pipeline(slot['best_pct'], slot['best_time_ms'], prefix=prefix))
+    pipeline.append({'$set': {'backfilled': True, 'updated_at': datetime.utcnow()}})
+    
+    try:
+        return user_daily_state_col.find_one_and_update(
+            {'user_id': user_oid, 'date': date_str, 'backfilled': {'$ne': True}},
+            pipeline,
+            upsert=True,
+            return_document=ReturnDocument.AFTER
+        )
+    except DuplicateKeyError:
+        # Backfilled concurrently
+        return user_daily_state_col.find_one({'user_id': user_oid, 'date': date_str})
+
+
+def get_user_daily_state(user_id: str, pack_date) -> List[Dict[str, Any]]:
+    """
+    Get the user's state for all quizzes of the day with a single read.
+    
+    A state document is backfilled from attempts/results once (days played
+    before it existed, or documents first created by an $inc upsert) and
+    then marked 'backfilled'.
+    
+    Returns:
+        List indexed by quiz_index (0-10):
+        [
+            {
+                'attempts': int,
+                'locked': bool,
+                'best_score': {'percentage': float, 'time_ms': int} or None
+            }
+        ]
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    user_oid = ObjectId(user_id)
+    
+    state = user_daily_state_col.find_one({'user_id': user_oid, 'date': date_str})
+    if state is None or not state.get('backfilled'):
+        state = _backfill_daily_state(user_oid, date_str)
+    
+    return _daily_state_from_slots(state.get('slots', {}))
+
+
+def _daily_state_from_slots(slots: Dict[str, Dict]) -> List[Dict[str, Any]]:
+    """Turn stored state slots into the per-quiz list returned by get_user_daily_state"""
+    daily_state = []
+    for quiz_index in range(QUIZZES_PER_DAY):
+        slot = slots.get(str(quiz_index), {})
+        best_score = None
+        if 'best_pct' in slot:
+            best_score = {
+                'percentage': slot['best_pct'],
+                'time_ms': slot['best_time_ms']
+            }
+        daily_state.append({
+            'attempts': slot.get('attempts', 0),
+            'locked': slot.get('locked', False),
+            'best_score': best_score
+        })
+    
+    return daily_state
+
+
+def reserve_attempt_slot(user_id: str, pack_date, quiz_index: int,
+                         expected_attempt: Optional[int] = None) -> Optional[int]:
+    """
+    Atomically reserve the next attempt for a quiz.
+    A single conditional increment enforces the attempt limit and the lock,
+    so concurrent or retried submits cannot race past MAX_ATTEMPTS.
+    
+    Args:
+        expected_attempt: Only reserve if the next attempt is this one (the
+                          attempt whose option order the client was shown)
+    
+    Returns:
+        The reserved attempt number (1-based), or None if the quiz is locked,
+        all attempts are used or the next attempt is not expected_attempt
+    """
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    user_oid = ObjectId(user_id)
+    slot = f'slots.{quiz_index}'
+    
+    attempts_filter = {'$not': {'$gte': MAX_ATTEMPTS}}
+    if expected_attempt is not None:
+        if not 1 <= expected_attempt <= MAX_ATTEMPTS:
+            return None
+        previous = expected_attempt - 1
+        attempts_filter = {'$in': [previous, None] if previous == 0 else [previous]}
+    
+    for _ in range(2):
+        state = user_daily_state_col.find_one_and_update(
+            {
+                'user_id': user_oid,
+                'date': date_str,
+                'backfilled': True,
+                f'{slot}.attempts': attempts_filter,
+                f'{slot}.locked': {'$ne': True}
+            },
+            {
+                '$inc': {f'{slot}.attempts': 1},
+                '$set': {'updated_at': datetime.utcnow()}
+            },
+            projection={slot: 1},
+            return_document=ReturnDocument.AFTER
+        )
+        if state is not None:
+            return state['slots'][str(quiz_index)]['attempts']
+        
+        # No match: either the slot is exhausted/locked, or the day's state
+        # document does not exist / is not backfilled yet (do that once, then retry)
+        if user_daily_state_col.count_documents(
+                {'user_id': user_oid, 'date': date_str, 'backfilled': True}, limit=1):
+            return None
+        get_user_daily_state(user_id, date_str)
+    
+    return None
+
+
+def release_attempt_slot(user_id: str, pack_date, quiz_index: int) -> None:
+    """Give back a reserved attempt when recording it failed"""
+    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
+    user_daily_state_col.update_one(
+        {
+            'user_id': ObjectId(user_id),
+            'date': date_str,
+            f'slots.{quiz_index}.attempts': {'$gt': 0}
+        },
+        {'$inc': {f'slots.{quiz_index}.attempts': -1}}
+    )
+
+
 def get_attempt_count(user_id: str, pack_date, quiz_index: int) -> int:
     """Get number of attempts user has made for a quiz"""
-    # Convert date to string if needed
-    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
-    return attempts_col.count_documents({
-        'user_id': ObjectId(user_id),
-        'date': date_str,
-        'quiz_index': quiz_index
-    })
+    return get_user_daily_state(user_id, pack_date)[quiz_index]['attempts']
 
 
 def is_quiz_locked(user_id: str, pack_date, quiz_index: int) -> bool:
     """Check if quiz is locked for user"""
-    # Convert date to string if needed
-    date_str = pack_date.isoformat() if isinstance(pack_date, date) else pack_date
-    result = results_col.find_one({
-        'user_id': ObjectId(user_id),
-        'date': date_str,
-        'quiz_index': quiz_index,
-        'locked_after_answers': True
-    })
-    return result is not None
+    return get_user_daily_state(user_id, pack_date)[quiz_index]['locked']
+
+
+# ============================================================================
+# RESULTS MIGRATION
+# ============================================================================
+# upsert_best_result relies on a unique (user_id, date, quiz_index) index on
+# 'results'. Databases created before it have a non-unique index on the same
+# key (which blocks creating the unique one) and may hold duplicates from
+# concurrent first submits.
+
+RESULTS_KEY = [('user_id', ASCENDING), ('date', ASCENDING), ('quiz_index', ASCENDING)]
+
+
+def dedupe_results() -> Dict[str, Any]:
+    """
+    Keep one results document per (user_id, date, quiz_index): the best one
+    (highest best_pct, then fastest best_time_ms), locked if any duplicate was.
+    
+    Returns:
+        {'duplicate_keys': int, 'deleted': int, 'dates': [str]}
+    """
+    duplicate_keys = 0
+    deleted = 0
+    dates = set()
+    
+    duplicates = results_col.aggregate([
+        {'$sort': {'best_pct': -1, 'best_time_ms': 1, '_id': 1}},
+        {'$group': {
+            '_id': {'user_id': '$user_id', 'date': '$date', 'quiz_index': '$quiz_index'},
+            'ids': {'$push': '$_id'},
+            'locked': {'$max': {'$ifNull': ['$locked_after_answers', False]}},
+            'count': {'$sum': 1}
+        }},
+        {'$match': {'count': {'$gt': 1}}}
+    ], allowDiskUse=True)
+    
+    for group in duplicates:
+        keep_id, *extra_ids = group['ids']
+        if group['locked']:
+            results_col.update_one({'_id': keep_id}, {'$set': {'locked_after_answers': True}})
+        deleted += results_col.delete_many({'_id': {'$in': extra_ids}}).deleted_count
+        duplicate_keys += 1
+        dates.add(group['_id']['date'])
+    
+    return {'duplicate_keys': duplicate_keys, 'deleted': deleted, 'dates': sorted(dates)}
+
+
+def migrate_results_unique_index() -> Dict[str, Any]:
+    """
+    Dedupe 'results', replace a non-unique (user_id, date, quiz_index) index
+    with the unique one and rebuild the leaderboards/daily totals of the days
+    that had duplicates. Safe to re-run.
+    
+    Returns:
+        {'duplicate_keys': int, 'deleted': int, 'dates': [str],
+         'dropped_index': str or None, 'created_index': str}
+    """
+    report = dedupe_results()
+    
+    report['dropped_index'] = None
+    for name, info in results_col.index_information().items():
+        keys = [(field, int(direction)) for field, direction in info['key']]
+        if keys == RESULTS_KEY and not info.get('unique'):
+            results_col.drop_index(name)
+            report['dropped_index'] = name
+    
+    # Submits between the dedupe and here could add a duplicate; dedupe once more
+    if report['dropped_index']:
+        extra = dedupe_results()
+        report['duplicate_keys'] += extra['duplicate_keys']
+        report['deleted'] += extra['deleted']
+        report['dates'] = sorted(set(report['dates']) | set(extra['dates']))
+    
+    report['created_index'] = results_col.create_index(RESULTS_KEY, unique=True)
+    
+    for date_str in report['dates']:
+        rebuild_leaderboard(date_str)
+    
+    return report
 
 
 def create_indexes():
-    """Create necessary database indexes for performance"""
-    # Results: leaderboard queries
-    results_col.create_index([
-        ('date', ASCENDING),
-        ('quiz_index', ASCENDING),
-        ('best_pct', DESCENDING),
-        ('best_time_ms', ASCENDING)
-    ])
-    
-    # Results: user lookup
-    results_col.create_index([
-        ('user_id', ASCENDING),
-        ('date', ASCENDING),
-        ('quiz_index', ASCENDING)
-    ])
-    
-    # Attempts: user history
-    attempts_col.create_index([
-        ('user_id', ASCENDING),
-        ('date', ASCENDING),
-        ('quiz_index', ASCENDING),
-        ('attempt_num', ASCENDING)
-    ])
-    
-    # Daily packs: date lookup
-    daily_packs_col.create_index([('date', ASCENDING)], unique=True)
-    
-    # Topics
-    topics_col.create_index([('active', ASCENDING)])
-    
-    # Questions
-    questions_col.create_index([
-        ('topic_id', ASCENDING),
-        ('active', ASCENDING)
-    ])
-    
-    print("✅ Indexes created successfully")
+    """Create necessary database indexes for performance (see index_registry.INDEXES)"""
+    from index_registry import apply_index_registry, print_index_report
+    report = apply_index_registry(db, create=True, replace_conflicts=True)
+    print_index_report(report)
+    return report
 
 
 def get_question_usage_stats() -> Dict[str, Any]:
@@ -727,32 +2208,25 @@ def get_question_usage_stats() -> Dict[str, Any]:
             'used_questions': int,
             'remaining_questions': int,
             'usage_percentage': float,
+            'cycle': int,
             'last_reset': datetime or None,
             'last_updated': datetime or None
         }
     """
     total_active = questions_col.count_documents({'active': True})
     
-    tracker = used_questions_col.find_one({'_id': 'global_tracker'})
-    
-    if tracker:
-        used_count = len(tracker.get('question_ids', []))
-        return {
-            'total_questions': total_active,
-            'used_questions': used_count,
-            'remaining_questions': total_active - used_count,
-            'usage_percentage': round((used_count / total_active * 100), 2) if total_active > 0 else 0,
-            'last_reset': tracker.get('last_reset'),
-            'last_updated': tracker.get('last_updated')
-        }
+    cycle = get_usage_cycle()
+    tracker = used_questions_col.find_one({'_id': USAGE_TRACKER_ID}) or {}
+    used_count = questions_col.count_documents({'active': True, 'last_used_cycle': cycle})
     
     return {
         'total_questions': total_active,
-        'used_questions': 0,
-        'remaining_questions': total_active,
-        'usage_percentage': 0,
-        'last_reset': None,
-        'last_updated': None
+        'used_questions': used_count,
+        'remaining_questions': total_active - used_count,
+        'usage_percentage': round((used_count / total_active * 100), 2) if total_active > 0 else 0,
+        'cycle': cycle,
+        'last_reset': tracker.get('last_reset'),
+        'last_updated': tracker.get('last_updated')
     }
 
 
@@ -764,17 +2238,7 @@ def reset_question_usage() -> Dict[str, Any]:
     Returns:
         {'success': True, 'message': str}
     """
-    result = used_questions_col.update_one(
-        {'_id': 'global_tracker'},
-        {
-            '$set': {
-                'question_ids': [],
-                'last_reset': datetime.utcnow(),
-                'reset_reason': 'manual'
-            }
-        },
-        upsert=True
-    )
+    start_new_usage_cycle(reason='manual')
     
     return {
         'success': True,
@@ -782,6 +2246,140 @@ def reset_question_usage() -> Dict[str, Any]:
     }
 
 
+# ============================================================================
+# PACK CAPACITY SIMULATION
+# ============================================================================
+
+def simulate_pack_capacity(days: int = 365, start_date: Optional[date] = None) -> Dict[str, Any]:
+    """
+    Forecast the no-repeat system by running the pack generator in memory for
+    the coming days against the current bank and usage cycle. Nothing is written.
+    
+    Args:
+        days: Number of daily packs to simulate
+        start_date: First simulated date (default: the day after the latest
+                    stored pack, or tomorrow)
+    
+    Returns:
+        {
+            'start_date': str, 'days': int,
+            'total_questions': int, 'questions_per_pack': int,
+            'unused_at_start': int,
+            'days_until_exhaustion': int or None,  # Simulated packs before the first new cycle
+            'cycle_resets': [str],                 # Dates that start a new cycle
+            'repeat_days': [str],                  # Dates that reuse questions within a cycle
+            'topics': [{'topic_id', 'name', 'questions', 'unused_at_start',
+                        'first_short_date', 'short_days'}],  # Dates after whose pack the topic
+                                                             # has < 3 unused; soonest first
+            'image_quiz': {'topic_id', 'questions', 'unused_at_start',
+                           'missing_days', 'first_missing_date',
+                           'repeat_days', 'first_repeat_date'}
+        }
+    """
+    if start_date is None:
+        latest = daily_packs_col.find_one({}, {'date': 1}, sort=[('date', DESCENDING)])
+        start_date = date.today() + timedelta(days=1)
+        if latest:
+            start_date = max(start_date, date.fromisoformat(latest['date']) + timedelta(days=1))
+    
+    bank, active_topics, image_quiz_topic_id = _load_pack_inputs(read_usage_cycle())
+    by_topic = bank['by_topic']
+    
+    def unused_count(topic_id) -> int:
+        used = bank['used']
+        return sum(1 for o in by_topic.get(topic_id, []) if not used[o])
+    
+    topic_stats = {
+        topic_id: {
+            'questions': len(by_topic[topic_id]),
+            'unused_at_start': unused_count(topic_id),
+            'first_short_date': None,
+            'short_days': 0
+        }
+        for topic_id in active_topics
+    }
+    unused_at_start = bank['used'].count(0)
+    image_quiz = {
+        'topic_id': str(image_quiz_topic_id) if image_quiz_topic_id else None,
+        'questions': len(by_topic.get(image_quiz_topic_id, [])) if image_quiz_topic_id else 0,
+        'unused_at_start': unused_count(image_quiz_topic_id) if image_quiz_topic_id else 0,
+        'missing_days': 0,
+        'first_missing_date': None,
+        'repeat_days': 0,
+        'first_repeat_date': None
+    }
+    
+    days_until_exhaustion = None
+    cycle_resets = []
+    repeat_days = []
+    
+    for offset in range(days):
+        pack_date = start_date + timedelta(days=offset)
+        date_str = pack_date.isoformat()
+        
+        used_before = bytes(bank['used'])
+        selection = _plan_daily_pack(bank, active_topics, image_quiz_topic_id, pack_date)
+        if selection['start_new_cycle']:
+            used_before = bytes(len(used_before))
+            cycle_resets.append(date_str)
+            if days_until_exhaustion is None:
+                days_until_exhaustion = offset
+        
+        # A pick repeats when the question was already used in this cycle
+        # (including earlier in the same pack)
+        seen = set()
+        repeated = []
+        for ordinal in selection['selected_ordinals']:
+            repeated.append(bool(used_before[ordinal]) or ordinal in seen)
+            seen.add(ordinal)
+        if any(repeated):
+            repeat_days.append(date_str)
+        
+        # Topics that can no longer supply a full set of unused questions
+        for topic_id, stats in topic_stats.items():
+            if unused_count(topic_id) < QUESTIONS_PER_TOPIC:
+                stats['short_days'] += 1
+                if stats['first_short_date'] is None:
+                    stats['first_short_date'] = date_str
+        
+        # Image Quiz slot (quiz 5, topic 1)
+        quizzes = selection['quizzes']
+        quiz_5 = quizzes[4]
+        if not image_quiz_topic_id or not quiz_5['topic_ids'] or quiz_5['topic_ids'][0] != image_quiz_topic_id:
+            image_quiz['missing_days'] += 1
+            if image_quiz['first_missing_date'] is None:
+                image_quiz['first_missing_date'] = date_str
+        else:
+            # Picks are recorded in quiz/slot order, so the slot starts after quizzes 1-4
+            start = QUESTIONS_PER_TOPIC * sum(len(q['topic_ids']) for q in quizzes[:4])
+            if any(repeated[start:start + QUESTIONS_PER_TOPIC]):
+                image_quiz['repeat_days'] += 1
+                if image_quiz['first_repeat_date'] is None:
+                    image_quiz['first_repeat_date'] = date_str
+    
+    topic_names = {
+        t['_id']: t['name'] for t in topics_col.find({'_id': {'$in': active_topics}}, {'name': 1})
+    }
+    topics = [
+        {'topic_id': str(topic_id), 'name': topic_names.get(topic_id, 'Unknown'), **stats}
+        for topic_id, stats in topic_stats.items()
+    ]
+    topics.sort(key=lambda t: (t['first_short_date'] is None, t['first_short_date'] or '', t['name']))
+    
+    return {
+        'start_date': start_date.isoformat(),
+        'days': days,
+        'total_questions': len(bank['question_ids']),
+        'questions_per_pack': QUESTIONS_PER_PACK,
+        'unused_at_start': unused_at_start,
+        'days_until_exhaustion': days_until_exhaustion,
+        'cycle_resets': cycle_resets,
+        'repeat_days': repeat_days,
+        'topics': topics,
+        'image_quiz': image_quiz
+    }
+
+
 if __name__ == '__main__':
     # Create indexes when module is run directly
     create_indexes()
@@ -0,0 +1,169 @@
+"""
+Shared MongoDB Connection for SocraQuest
+Owns the one MongoClient per process (plus one Motor client for the async
+layer) that every module uses, with pool settings from the environment:
+
+    MONGO_URL                         mongodb://localhost:27017/
+    MONGO_DB_NAME                     socraquest
+    MONGO_MAX_POOL_SIZE               100
+    MONGO_MIN_POOL_SIZE               0
+    MONGO_WAIT_QUEUE_TIMEOUT_MS       10000  (fail instead of waiting forever for a connection)
+    MONGO_SERVER_SELECTION_TIMEOUT_MS 30000
+    MONGO_CONNECT_TIMEOUT_MS          20000
+    MONGO_SOCKET_TIMEOUT_MS           (unset: no timeout)
+    MONGO_COMPRESSORS                 (unset; e.g. "zstd,snappy,zlib")
+    MONGO_READ_PREFERENCE             primary
+
+Connection pool activity is tracked with a CMAP listener per client and
+reported by get_pool_stats().
+"""
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Optional, Any
+from pymongo import MongoClient, monitoring
+
+MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
+DB_NAME = os.environ.get('MONGO_DB_NAME', 'socraquest')
+
+
+def _int_env(name: str, default: Optional[int]) -> Optional[int]:
+    value = os.environ.get(name)
+    return int(value) if value else default
+
+
+def client_options() -> Dict[str, Any]:
+    """MongoClient keyword options from the environment"""
+    options = {
+        'maxPoolSize': _int_env('MONGO_MAX_POOL_SIZE', 100),
+        'minPoolSize': _int_env('MONGO_MIN_POOL_SIZE', 0),
+        'waitQueueTimeoutMS': _int_env('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000),
+        'serverSelectionTimeoutMS': _int_env('MONGO_SERVER_SELECTION_TIMEOUT_MS', 30000),
+        'connectTimeoutMS': _int_env('MONGO_CONNECT_TIMEOUT_MS', 20000),
+        'socketTimeoutMS': _int_env('MONGO_SOCKET_TIMEOUT_MS', None),
+        'compressors': os.environ.get('MONGO_COMPRESSORS') or None,
+        'readPreference': os.environ.get('MONGO_READ_PREFERENCE', 'primary')
+    }
+    return {key: value for key, value in options.items() if value is not None}
+
+
+class _PoolStatsListener(monitoring.ConnectionPoolListener):
+    """Counts connection pool events per server address"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._servers = defaultdict(lambda: defaultdict(int))
+
+    def _bump(self, event, **deltas):
+        address = '%s:%s' % event.address
+        with self._lock:
+            server = self._servers[address]
+            for key, delta in deltas.items():
+                server[key] += delta
+                if key == 'in_use':
+                    server['max_in_use'] = max(server['max_in_use'], server['in_use'])
+
+    def pool_created(self, event):
+        self._bump(event)
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_cleared(self, event):
+        self._bump(event, pool_cleared=1)
+
+    def pool_closed(self, event):
+        pass
+
+    def connection_created(self, event):
+        self._bump(event, open=1, created=1)
+
+    def connection_ready(self, event):
+        pass
+
+    def connection_closed(self, event):
+        self._bump(event, open=-1, closed=1)
+
+    def connection_check_out_started(self, event):
+        self._bump(event, waiting=1)
+
+    def connection_check_out_failed(self, event):
+        deltas = {'waiting': -1, 'check_out_failed': 1}
+        if event.reason == monitoring.ConnectionCheckOutFailedReason.TIMEOUT:
+            deltas['wait_queue_timeouts'] = 1
+        self._bump(event, **deltas)
+
+    def connection_checked_out(self, event):
+        self._bump(event, waiting=-1, in_use=1, checked_out=1)
+
+    def connection_checked_in(self, event):
+        self._bump(event, in_use=-1)
+
+    def snapshot(self) -> Dict[str, Dict[str, int]]:
+        with self._lock:
+            return {address: dict(counters) for address, counters in self._servers.items()}
+
+
+_lock = threading.Lock()
+_client: Optional[MongoClient] = None
+_async_client = None
+_sync_listener = _PoolStatsListener()
+_async_listener = _PoolStatsListener()
+
+
+def get_client() -> MongoClient:
+    """The process-wide pymongo client"""
+    global _client
+    with _lock:
+        if _client is None:
+            _client = MongoClient(MONGO_URL, event_listeners=[_sync_listener], **client_options())
+        return _client
+
+
+def get_db():
+    """The application database on the shared pymongo client"""
+    return get_client()[DB_NAME]
+
+
+def get_async_client():
+    """The process-wide Motor client (for async endpoints)"""
+    global _async_client
+    with _lock:
+        if _async_client is None:
+            from motor.motor_asyncio import AsyncIOMotorClient
+            _async_client = AsyncIOMotorClient(MONGO_URL, event_listeners=[_async_listener], **client_options())
+        return _async_client
+
+
+def get_async_db():
+    """The application database on the shared Motor client"""
+    return get_async_client()[DB_NAME]
+
+
+def get_pool_stats() -> Dict[str, Any]:
+    """Pool configuration and per-server connection counters of both clients"""
+    options = client_options()
+    return {
+        'database': DB_NAME,
+        'options': options,
+        'sync': {
+            'connected': _client is not None,
+            'servers': _sync_listener.snapshot()
+        },
+        'async': {
+            'connected': _async_client is not None,
+            'servers': _async_listener.snapshot()
+        }
+    }
+
+
+def close_clients() -> None:
+    """Close both clients (on shutdown)"""
+    global _client, _async_client
+    with _lock:
+        client, _client = _client, None
+        async_client, _async_client = _async_client, None
+    if client:
+        client.close()
+    if async_client:
+        async_client.close()
@@ -0,0 +1,318 @@
+"""
+Index Registry for SocraQuest
+Declares every index the app's queries rely on, in one place, and applies
+them idempotently at startup.
+
+apply_index_registry() creates what is missing and reports the rest instead of
+failing: an index whose key matches but whose options differ (e.g. an old
+non-unique index where the registry wants a unique one) is a conflict;
+indexes on the database that are not declared here are listed as extra.
+Index names are left to MongoDB's defaults, so indexes created by earlier
+versions of create_indexes() are recognized.
+
+Unique indexes are relied on by the code (atomic upserts, one account per
+email, ...), so a conflict or failure on one is "blocking" and logged as an
+error. Conflicts are only reported at startup: every worker runs the registry,
+and dropping an index there would race the other workers and leave hot
+lookups unindexed. One-off runs (migrate_results_index.py, create_indexes())
+pass replace_conflicts=True, which drops and recreates conflicting indexes of
+specs marked replace_on_conflict; if the new index cannot be built (duplicate
+data) the old one is restored and the spec's remedy is reported.
+"""
+import os
+from datetime import datetime
+from typing import Dict, List, Optional, Any
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import OperationFailure
+
+from database import get_db
+
+# Set to 0 to only report (e.g. when indexes are managed out of band)
+INDEX_BOOTSTRAP = os.environ.get('INDEX_BOOTSTRAP', '1') != '0'
+
+COMPARED_OPTIONS = ('unique', 'sparse', 'partialFilterExpression', 'expireAfterSeconds')
+
+
+def _index(*keys, replace_on_conflict: bool = False, remedy: Optional[str] = None,
+           **options) -> Dict[str, Any]:
+    return {
+        'keys': list(keys),
+        'options': options,
+        'replace_on_conflict': replace_on_conflict,
+        'remedy': remedy
+    }
+
+
+INDEXES: Dict[str, List[Dict[str, Any]]] = {
+    'results': [
+        # Best results by quiz, ranked
+        _index(('date', ASCENDING), ('quiz_index', ASCENDING), ('best_pct', DESCENDING), ('best_time_ms', ASCENDING)),
+        # One best result per user/date/quiz (atomic upsert)
+        _index(('user_id', ASCENDING), ('date', ASCENDING), ('quiz_index', ASCENDING), unique=True,
+               replace_on_conflict=True, remedy='python migrate_results_index.py')
+    ],
+    'attempts': [
+        # User history and last-attempt lookups
+        _index(('user_id', ASCENDING), ('date', ASCENDING), ('quiz_index', ASCENDING), ('attempt_num', ASCENDING)),
+        # Recently active players (push targeting)
+        _index(('finished_at', ASCENDING)),
+        # Attempts whose post-submit event was never enqueued (outbox sweeps)
+        _index(('post_submit_pending', ASCENDING), ('finished_at', ASCENDING),
+               partialFilterExpression={'post_submit_pending': True})
+    ],
+    'leaderboards': [
+        # Sorted page reads
+        _index(('date', ASCENDING), ('quiz_index', ASCENDING), ('best_pct', DESCENDING),
+               ('best_time_ms', ASCENDING), ('user_id', ASCENDING)),
+        # Per-user upserts
+        _index(('user_id', ASCENDING), ('date', ASCENDING), ('quiz_index', ASCENDING), unique=True)
+    ],
+    'daily_totals': [
+        # Overall daily ranking
+        _index(('date', ASCENDING), ('avg_pct', DESCENDING), ('total_time_ms', ASCENDING), ('user_id', ASCENDING)),
+        # Per-user merges
+        _index(('user_id', ASCENDING), ('date', ASCENDING), unique=True)
+    ],
+    'user_daily_state': [
+        _index(('user_id', ASCENDING), ('date', ASCENDING), unique=True)
+    ],
+    'post_submit_events': [
+        # Badge lookups by attempt
+        _index(('attempt_id', ASCENDING), ('user_id', ASCENDING)),
+        # Outbox sweeps
+        _index(('status', ASCENDING), ('created_at', ASCENDING))
+    ],
+    'daily_packs': [
+        _index(('date', ASCENDING), unique=True)
+    ],
+    'quiz_payloads': [
+        _index(('date', ASCENDING), ('quiz_index', ASCENDING), ('lang', ASCENDING), unique=True),
+        # Invalidation by contained question/topic
+        _index(('question_ids', ASCENDING)),
+        _index(('topic_ids', ASCENDING))
+    ],
+    'leases': [
+        # Expired leases are removed by Mongo (they are also reclaimable before that)
+        _index(('expires_at', ASCENDING), expireAfterSeconds=3600)
+    ],
+    'topics': [
+        _index(('active', ASCENDING))
+    ],
+    'questions': [
+        _index(('topic_id', ASCENDING), ('active', ASCENDING)),
+        # No-repeat usage counts per cycle
+        _index(('active', ASCENDING), ('last_used_cycle', ASCENDING))
+    ],
+    'users': [
+        # Login and registration checks
+        _index(('email', ASCENDING), unique=True, replace_on_conflict=True,
+               remedy='merge or delete users sharing an email, then python migrate_results_index.py'),
+        # Referral code lookups (users created before referrals have none)
+        _index(('referral_code', ASCENDING), unique=True,
+               partialFilterExpression={'referral_code': {'$type': 'string'}}),
+        # Referred users list, newest first
+        _index(('referred_by', ASCENDING), ('created_at', DESCENDING))
+    ],
+    'groups': [
+        # Join by code
+        _index(('code', ASCENDING), unique=True, replace_on_conflict=True,
+               remedy='give groups sharing a code new codes, then python migrate_results_index.py'),
+        # A user's groups
+        _index(('members', ASCENDING))
+    ],
+    'user_devices': [
+        # A user's devices; one registration per user and token
+        _index(('user_id', ASCENDING), ('fcm_token', ASCENDING), unique=True)
+    ],
+    'notification_logs': [
+        # Latest notifications
+        _index(('sent_at', DESCENDING))
+    ]
+}
+
+_last_report: Optional[Dict[str, Any]] = None
+
+
+def _normalize_keys(keys) -> List[tuple]:
+    return [(field, int(direction) if isinstance(direction, (int, float)) else direction)
+            for field, direction in keys]
+
+
+def _options_of(info: Dict[str, Any]) -> Dict[str, Any]:
+    options = {}
+    for option in COMPARED_OPTIONS:
+        if option in info:
+            value = info[option]
+            options[option] = dict(value) if isinstance(value, dict) else value
+    if not options.get('unique'):
+        options.pop('unique', None)
+    if not options.get('sparse'):
+        options.pop('sparse', None)
+    return options
+
+
+def _is_blocking(spec: Dict[str, Any]) -> bool:
+    """Whether the code depends on this index for correctness"""
+    return bool(spec['options'].get('unique'))
+
+
+def _replace_index(collection, name: str, info: Dict[str, Any], spec: Dict[str, Any]) -> Optional[str]:
+    """Drop a conflicting index and create the declared one; restore the old one on failure"""
+    collection.drop_index(name)
+    try:
+        collection.create_index(spec['keys'], **spec['options'])
+        return None
+    except OperationFailure as e:
+        collection.create_index(
+            info['key'], name=name,
+            **{option: info[option] for option in COMPARED_OPTIONS if option in info}
+        )
+        return str(e)
+
+
+def apply_index_registry(db=None, create: bool = INDEX_BOOTSTRAP,
+                         replace_conflicts: bool = False) -> Dict[str, Any]:
+    """
+    Compare the database's indexes with the registry and create missing ones.
+
+    Args:
+        db: Database (default: the shared application database)
+        create: False to only report
+        replace_conflicts: Replace conflicting replace_on_conflict indexes
+            (single-process runs only, never at startup)
+
+    Returns:
+        {
+            'checked_at': datetime,
+            'present': int,
+            'created': [{'collection', 'keys', 'options'}],
+            'replaced': [{'collection', 'name', 'keys', 'options'}],   # Conflicts fixed by replacing
+            'missing': [{'collection', 'keys', 'options', 'blocking'}],  # Not created (report-only)
+            'conflicts': [{'collection', 'name', 'keys', 'expected', 'actual', 'blocking',
+                           'remedy', 'replace_error'}],           # replace_error: replacing failed
+            'errors': [{'collection', 'keys', 'error', 'blocking', 'remedy'}],  # Creation failed
+            'extra': [{'collection', 'name', 'keys'}],          # On the database, not declared
+            'blocking': int,    # Missing/conflicting/failed indexes the code relies on
+            'ok': bool          # No blocking problems
+        }
+    """
+    global _last_report
+    db = db if db is not None else get_db()
+    report = {
+        'checked_at': datetime.utcnow(),
+        'present': 0,
+        'created': [],
+        'replaced': [],
+        'missing': [],
+        'conflicts': [],
+        'errors': [],
+        'extra': []
+    }
+
+    for collection_name, specs in INDEXES.items():
+        collection = db[collection_name]
+        existing = {
+            name: info for name, info in collection.index_information().items()
+            if name != '_id_'
+        }
+        matched = set()
+
+        for spec in specs:
+            keys = _normalize_keys(spec['keys'])
+            blocking = _is_blocking(spec)
+            entry = {'collection': collection_name, 'keys': keys, 'options': spec['options']}
+
+            found = next(
+                (name for name, info in existing.items() if _normalize_keys(info['key']) == keys),
+                None
+            )
+            if found:
+                matched.add(found)
+                actual = _options_of(existing[found])
+                if actual == _options_of(spec['options']):
+                    report['present'] += 1
+                    continue
+
+                replace_error = None
+                if create and replace_conflicts and spec['replace_on_conflict']:
+                    try:
+                        replace_error = _replace_index(collection, found, existing[found], spec)
+                    except OperationFailure as e:
+                        replace_error = str(e)
+                    if replace_error is None:
+                        report['replaced'].append({**entry, 'name': found})
+                        continue
+
+                report['conflicts'].append({
+                    'collection': collection_name,
+                    'name': found,
+                    'keys': keys,
+                    'expected': spec['options'],
+                    'actual': actual,
+                    'blocking': blocking,
+                    'remedy': spec['remedy'],
+                    'replace_error': replace_error
+                })
+                continue
+
+            if not create:
+                report['missing'].append({**entry, 'blocking': blocking})
+                continue
+
+            try:
+                collection.create_index(spec['keys'], **spec['options'])
+                report['created'].append(entry)
+            except OperationFailure as e:
+                report['errors'].append({
+                    'collection': collection_name,
+                    'keys': keys,
+                    'error': str(e),
+                    'blocking': blocking,
+                    'remedy': spec['remedy']
+                })
+
+        for name, info in existing.items():
+            if name not in matched:
+                report['extra'].append({
+                    'collection': collection_name,
+                    'name': name,
+                    'keys': _normalize_keys(info['key'])
+                })
+
+    report['blocking'] = sum(
+        1 for item in report['missing'] + report['conflicts'] + report['errors'] if item['blocking']
+    )
+    report['ok'] = report['blocking'] == 0
+    _last_report = report
+    return report
+
+
+def print_index_report(report: Dict[str, Any]) -> None:
+    """Log a one-line summary plus every problem (blocking ones as errors)"""
+    print(f"🗂️  Indexes: {report['present']} present, {len(report['created'])} created, "
+          f"{len(report['replaced'])} replaced, {len(report['missing'])} missing, "
+          f"{len(report['conflicts'])} conflicts, {len(report['errors'])} errors, "
+          f"{len(report['extra'])} extra")
+    for replaced in report['replaced']:
+        print(f"🔁 Replaced index {replaced['collection']}.{replaced['name']} with {replaced['options']}")
+    for conflict in report['conflicts']:
+        icon = '❌' if conflict['blocking'] else '⚠️ '
+        remedy = f" (fix: {conflict['remedy']})" if conflict['remedy'] else ''
+        print(f"{icon} Index conflict on {conflict['collection']}.{conflict['name']}: "
+              f"expected {conflict['expected']}, found {conflict['actual']}{remedy}")
+        if conflict['replace_error']:
+            print(f"   Replacing it failed: {conflict['replace_error']}")
+    for error in report['errors']:
+        icon = '❌' if error['blocking'] else '⚠️ '
+        remedy = f" (fix: {error['remedy']})" if error['remedy'] else ''
+        print(f"{icon} Could not create index {error['keys']} on {error['collection']}: {error['error']}{remedy}")
+    for missing in report['missing']:
+        icon = '❌' if missing['blocking'] else '⚠️ '
+        print(f"{icon} Missing index {missing['keys']} on {missing['collection']}")
+    if not report['ok']:
+        print(f"❌ {report['blocking']} index problems break uniqueness the app relies on")
+
+
+def get_last_index_report() -> Optional[Dict[str, Any]]:
+    """The report of the last apply/check in this process"""
+    return _last_report
@@ -0,0 +1,25 @@
+"""
+One-off migration for SocraQuest databases created before results were
+unique per (user_id, date, quiz_index).
+Removes duplicate results (keeping the best), replaces the old non-unique
+index with a unique one and rebuilds the affected leaderboards. Then replaces
+any other conflicting unique index of the registry (users.email, groups.code),
+which the app only reports at startup. Run it from one process. Safe to re-run.
+
+Usage:
+    python migrate_results_index.py
+"""
+from core_services import migrate_results_unique_index
+from index_registry import apply_index_registry, print_index_report
+
+
+if __name__ == '__main__':
+    report = migrate_results_unique_index()
+    print(f"🧹 Removed {report['deleted']} duplicate results "
+          f"({report['duplicate_keys']} keys on {len(report['dates'])} days)")
+    if report['dropped_index']:
+        print(f"🗑️  Dropped non-unique index {report['dropped_index']}")
+    print(f"✅ Unique index {report['created_index']} in place")
+    if report['dates']:
+        print(f"🏆 Rebuilt leaderboards for {', '.join(report['dates'])}")
+    print_index_report(apply_index_registry(create=True, replace_conflicts=True))
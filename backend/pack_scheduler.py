@@ -0,0 +1,143 @@
+"""
+Ahead-of-Time Pack Scheduler for SocraQuest
+Generates daily packs before they are needed, so the first request of the day
+only reads a stored pack.
+
+Every uvicorn worker starts the scheduler thread, but only the holder of the
+'pack-scheduler' lease does any work; the others keep checking in case the
+leader dies. Each run generates any missing pack from today up to
+PACK_PRECOMPUTE_DAYS ahead, in date order, with the existing deterministic
+generate_daily_pack (which is itself single-flight, so a user request racing
+the scheduler is safe).
+"""
+import os
+import threading
+import traceback
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Optional, Any
+from bson import ObjectId
+
+from core_services import (
+    generate_daily_pack,
+    acquire_lease,
+    release_lease,
+    daily_packs_col
+)
+
+PRECOMPUTE_DAYS = int(os.environ.get('PACK_PRECOMPUTE_DAYS', '2'))  # Days after today
+RUN_INTERVAL_SECONDS = int(os.environ.get('PACK_SCHEDULER_INTERVAL_SECONDS', '600'))
+LEASE_NAME = 'pack-scheduler'
+LEASE_SECONDS = RUN_INTERVAL_SECONDS * 2 + 60  # Outlives one missed run
+
+_owner = str(ObjectId())
+_stop_event = threading.Event()
+_wake_event = threading.Event()
+_run_requested = threading.Event()
+_thread: Optional[threading.Thread] = None
+
+_status: Dict[str, Any] = {
+    'is_leader': False,
+    'last_run_at': None,
+    'last_generated': [],
+    'last_error': None,
+    'last_error_at': None
+}
+
+
+def _pack_dates(today: date) -> List[date]:
+    return [today + timedelta(days=offset) for offset in range(PRECOMPUTE_DAYS + 1)]
+
+
+def run_once(today: Optional[date] = None) -> List[str]:
+    """
+    Generate every missing pack from today through PRECOMPUTE_DAYS ahead.
+
+    Returns:
+        Dates (YYYY-MM-DD) of the packs generated in this run
+    """
+    today = today or date.today()
+    pack_dates = _pack_dates(today)
+    existing = {
+        pack['date'] for pack in daily_packs_col.find(
+            {'date': {'$in': [d.isoformat() for d in pack_dates]}},
+            {'date': 1}
+        )
+    }
+
+    generated = []
+    for pack_date in pack_dates:
+        if pack_date.isoformat() in existing:
+            continue
+        generate_daily_pack(pack_date)
+        generated.append(pack_date.isoformat())
+    return generated
+
+
+def _scheduler_loop() -> None:
+    while not _stop_event.is_set():
+        try:
+            _status['is_leader'] = acquire_lease(LEASE_NAME, _owner, LEASE_SECONDS)
+            # A triggered run happens on this worker even without the lease
+            # (generate_daily_pack is single-flight, so racing the leader is safe)
+            requested = _run_requested.is_set()
+            _run_requested.clear()
+            if _status['is_leader'] or requested:
+                generated = run_once()
+                _status['last_run_at'] = datetime.utcnow()
+                _status['last_generated'] = generated
+                if generated:
+                    print(f"📦 Precomputed packs for {', '.join(generated)}")
+        except Exception as e:
+            traceback.print_exc()
+            _status['last_error'] = str(e)
+            _status['last_error_at'] = datetime.utcnow()
+            print(f"❌ Pack scheduler run failed: {e}")
+
+        _wake_event.wait(RUN_INTERVAL_SECONDS)
+        _wake_event.clear()
+
+
+def trigger_run() -> None:
+    """Ask this worker's scheduler to run now, leader or not (e.g. after packs were deleted)"""
+    _run_requested.set()
+    _wake_event.set()
+
+
+def start_scheduler() -> None:
+    """Start the scheduler thread (idempotent)"""
+    global _thread
+    if _thread:
+        return
+
+    _stop_event.clear()
+    _thread = threading.Thread(target=_scheduler_loop, name='pack-scheduler', daemon=True)
+    _thread.start()
+    print(f"✅ Pack scheduler started ({PRECOMPUTE_DAYS} days ahead, every {RUN_INTERVAL_SECONDS}s)")
+
+
+def stop_scheduler(timeout: float = 5.0) -> None:
+    """Stop the scheduler thread and hand the lease to another worker"""
+    global _thread
+    _stop_event.set()
+    _wake_event.set()
+    if _thread:
+        _thread.join(timeout=timeout)
+        _thread = None
+    if _status['is_leader']:
+        release_lease(LEASE_NAME, _owner)
+        _status['is_leader'] = False
+
+
+def get_scheduler_status() -> Dict[str, Any]:
+    """Scheduler state of this worker plus which upcoming packs exist"""
+    pack_dates = [d.isoformat() for d in _pack_dates(date.today())]
+    existing = {
+        pack['date'] for pack in daily_packs_col.find({'date': {'$in': pack_dates}}, {'date': 1})
+    }
+    return {
+        'running': _thread is not None and _thread.is_alive(),
+        'days_ahead': PRECOMPUTE_DAYS,
+        'interval_seconds': RUN_INTERVAL_SECONDS,
+        **_status,
+        'packs': {d: d in existing for d in pack_dates}
+    }
@@ -0,0 +1,124 @@
+"""
+Password Hashing Service for SocraQuest
+Runs bcrypt in a dedicated process pool, so password work neither blocks the
+event loop nor holds request threads, and does not compete for the GIL with
+quiz traffic.
+
+The number of queued/running password jobs is capped: beyond
+PASSWORD_POOL_MAX_PENDING, calls fail fast with PasswordPoolBusy (the API
+answers 503 + Retry-After) instead of piling up behind a login spike.
+
+Worker processes are spawned, not forked: the API process runs threads and
+open MongoClients, which must not be inherited by a fork. Call
+start_password_pool() at startup.
+"""
+import os
+import time
+import asyncio
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, Optional, Any
+
+import bcrypt
+
+POOL_WORKERS = int(os.environ.get('PASSWORD_POOL_WORKERS', '2'))
+MAX_PENDING = int(os.environ.get('PASSWORD_POOL_MAX_PENDING', '64'))
+
+_pool: Optional[ProcessPoolExecutor] = None
+_lock = threading.Lock()
+_metrics = {
+    'submitted': 0,
+    'completed': 0,
+    'failed': 0,
+    'rejected': 0,
+    'in_flight': 0,
+    'max_in_flight': 0,
+    'total_ms': 0.0
+}
+
+
+class PasswordPoolBusy(Exception):
+    """Too many password operations queued"""
+
+
+def _hash_in_worker(password: str) -> str:
+    return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
+
+
+def _verify_in_worker(password: str, hashed: str) -> bool:
+    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
+
+
+def _get_pool() -> ProcessPoolExecutor:
+    global _pool
+    with _lock:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(
+                max_workers=POOL_WORKERS,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+        return _pool
+
+
+def start_password_pool() -> None:
+    """Create the worker pool (on startup, rather than on the first login)"""
+    _get_pool()
+
+
+async def _run(fn, *args):
+    with _lock:
+        if _metrics['in_flight'] >= MAX_PENDING:
+            _metrics['rejected'] += 1
+            raise PasswordPoolBusy(f"{_metrics['in_flight']} password operations pending")
+        _metrics['submitted'] += 1
+        _metrics['in_flight'] += 1
+        _metrics['max_in_flight'] = max(_metrics['max_in_flight'], _metrics['in_flight'])
+
+    started = time.perf_counter()
+    try:
+        result = await asyncio.get_running_loop().run_in_executor(_get_pool(), fn, *args)
+    except Exception:
+        with _lock:
+            _metrics['failed'] += 1
+        raise
+    finally:
+        with _lock:
+            _metrics['in_flight'] -= 1
+            _metrics['total_ms'] += (time.perf_counter() - started) * 1000
+
+    with _lock:
+        _metrics['completed'] += 1
+    return result
+
+
+async def hash_password_async(password: str) -> str:
+    """bcrypt-hash a password in the process pool"""
+    return await _run(_hash_in_worker, password)
+
+
+async def verify_password_async(password: str, hashed: str) -> bool:
+    """Check a password against a bcrypt hash in the process pool"""
+    return await _run(_verify_in_worker, password, hashed)
+
+
+def get_password_pool_status() -> Dict[str, Any]:
+    """Pool size, queue depth and counters for monitoring"""
+    with _lock:
+        finished = _metrics['completed'] + _metrics['failed']
+        return {
+            'workers': POOL_WORKERS,
+            'max_pending': MAX_PENDING,
+            'started': _pool is not None,
+            **{k: v for k, v in _metrics.items() if k != 'total_ms'},
+            'avg_ms': round(_metrics['total_ms'] / finished, 1) if finished else 0
+        }
+
+
+def shutdown_password_pool() -> None:
+    """Stop the worker processes"""
+    global _pool
+    with _lock:
+        pool, _pool = _pool, None
+    if pool:
+        pool.shutdown(wait=False, cancel_futures=True)
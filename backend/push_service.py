@@ -2,17 +2,15 @@
 Push Notification Service using Firebase Cloud Messaging
 Handles all notification types for SocraQuest
 """
-import os
 import firebase_admin
 from firebase_admin import credentials, messaging
 from datetime import datetime
 from typing import List, Dict, Optional
-from pymongo import MongoClient
 
-# MongoDB connection
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URL)
-db = client['socraquest']
+from database import get_db
+
+# MongoDB connection (shared per-process client)
+db = get_db()
 
 notification_settings_col = db['notification_settings']
 notification_logs_col = db['notification_logs']
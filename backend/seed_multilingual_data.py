@@ -1,13 +1,11 @@
 """
 Seed database with multilingual sample questions (English + Slovak)
 """
-import os
-from pymongo import MongoClient
 from bson import ObjectId
 
-MONGO_URL = os.environ.get('MONGO_URL', 'mongodb://localhost:27017/')
-client = MongoClient(MONGO_URL)
-db = client['socraquest']
+from database import get_db
+
+db = get_db()
 
 topics_col = db['topics']
 questions_col = db['questions']
@@ -1,31 +1,50 @@
-from fastapi import FastAPI, HTTPException, Depends, status, Query, UploadFile, File
-from fastapi.responses import StreamingResponse
+from fastapi import FastAPI, HTTPException, Depends, status, Query, UploadFile, File, Request
+from fastapi.responses import StreamingResponse, Response
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from pydantic import BaseModel, EmailStr, Field
 from typing import List, Optional, Dict, Any
 from datetime import datetime, date, timedelta
 from bson import ObjectId
 import os
+import json
+import gzip
+import hashlib
+import threading
 import jwt
 import bcrypt
 import pandas as pd
 import io
-from pymongo import MongoClient, ASCENDING, DESCENDING
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import DuplicateKeyError
+from cachetools import TTLCache
 
 # Import core services
 from core_services import (
     generate_daily_pack,
+    get_pack,
     get_quiz_questions,
-    score_attempt,
     record_attempt,
     compute_leaderboard,
+    get_user_rank,
+    get_leaderboard_around_user,
+    get_daily_ranking_around_user,
+    rebuild_leaderboard,
     lock_quiz_after_answers,
-    get_attempt_count,
-    is_quiz_locked,
+    get_user_daily_state,
+    reserve_attempt_slot,
+    release_attempt_slot,
     serialize_doc,
+    count_active_questions_by_topic,
     get_question_usage_stats,
     reset_question_usage,
+    simulate_pack_capacity,
+    bump_pack_version,
+    get_option_order,
+    apply_option_order,
+    to_displayed_key,
+    invalidate_quiz_payloads,
     db,
     users_col,
     topics_col,
@@ -47,10 +66,33 @@ from push_service import (
     NOTIFICATION_TEMPLATES
 )
 from badge_service import (
-    check_and_award_badges,
     get_user_badges,
     BADGES
 )
+from submit_pipeline import (
+    enqueue_post_submit,
+    get_post_submit_result,
+    get_pipeline_status,
+    start_workers,
+    stop_workers
+)
+import async_core_services as aio
+from database import get_pool_stats, close_clients
+from index_registry import apply_index_registry, get_last_index_report, print_index_report
+from password_service import (
+    hash_password_async,
+    verify_password_async,
+    get_password_pool_status,
+    start_password_pool,
+    shutdown_password_pool,
+    PasswordPoolBusy
+)
+from pack_scheduler import (
+    start_scheduler,
+    stop_scheduler,
+    trigger_run as trigger_pack_scheduler,
+    get_scheduler_status
+)
 
 app = FastAPI(title="SocraQuest API")
 
@@ -68,6 +110,12 @@ security = HTTPBearer()
 JWT_SECRET = os.environ.get('JWT_SECRET', 'socraquest-secret-key-change-in-production')
 JWT_ALGORITHM = 'HS256'
 
+# Authenticated-user cache: slim principals (no badges/stats), bounded and short-lived
+# (changes to a user's email, nickname or role show up once the entry expires)
+PRINCIPAL_CACHE_SIZE = int(os.environ.get('PRINCIPAL_CACHE_SIZE', '10000'))
+PRINCIPAL_CACHE_TTL_SECONDS = int(os.environ.get('PRINCIPAL_CACHE_TTL_SECONDS', '60'))
+PRINCIPAL_FIELDS = {'email': 1, 'nickname': 1, 'role': 1, 'avatar_seed': 1}
+
 # ============================================================================
 # MODELS
 # ============================================================================
@@ -126,6 +174,7 @@ class AnswerSubmit(BaseModel):
 class QuizSubmit(BaseModel):
     answers: List[AnswerSubmit]
     time_ms: int
+    attempt_number: int  # As returned with the questions (selects the option order)
 
 class GroupCreate(BaseModel):
     name: str = Field(min_length=2, max_length=50)
@@ -145,9 +194,6 @@ class GroupInvite(BaseModel):
 def hash_password(password: str) -> str:
     return bcrypt.hashpw(password.encode('utf-8'), bcrypt.gensalt()).decode('utf-8')
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode('utf-8'), hashed.encode('utf-8'))
-
 def create_token(user_id: str, email: str, role: str) -> str:
     payload = {
         'user_id': user_id,
@@ -165,12 +211,29 @@ def decode_token(token: str) -> Dict:
     except jwt.InvalidTokenError:
         raise HTTPException(status_code=401, detail="Invalid token")
 
-def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict:
+_principal_cache = TTLCache(maxsize=PRINCIPAL_CACHE_SIZE, ttl=PRINCIPAL_CACHE_TTL_SECONDS)
+_principal_cache_lock = threading.Lock()
+
+async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)) -> Dict:
+    """
+    The authenticated user's principal: _id, email, nickname, role, avatar_seed.
+    Endpoints that need more of the user document read it themselves.
+    """
     payload = decode_token(credentials.credentials)
-    user = users_col.find_one({'_id': ObjectId(payload['user_id'])})
-    if not user:
-        raise HTTPException(status_code=401, detail="User not found")
-    return serialize_doc(user)
+    user_id = payload['user_id']
+    
+    with _principal_cache_lock:
+        principal = _principal_cache.get(user_id)
+    
+    if principal is None:
+        user = await aio.find_user(user_id, PRINCIPAL_FIELDS)
+        if not user:
+            raise HTTPException(status_code=401, detail="User not found")
+        principal = serialize_doc(user)
+        with _principal_cache_lock:
+            _principal_cache[user_id] = principal
+    
+    return dict(principal)  # Callers may modify their copy
 
 def get_current_admin(current_user: Dict = Depends(get_current_user)) -> Dict:
     if current_user.get('role') != 'admin':
@@ -205,8 +268,8 @@ def _check_referral_badges(user_id: ObjectId, users_col):
 # AUTH ENDPOINTS
 # ============================================================================
 
-@app.post("/api/auth/register", response_model=TokenResponse)
-def register(data: RegisterRequest):
+def _prepare_registration(data: RegisterRequest):
+    """Validate a registration and resolve its referral data (blocking DB work)"""
     # Check if user exists
     if users_col.find_one({'email': data.email}):
         raise HTTPException(status_code=400, detail="Email already registered")
@@ -225,10 +288,14 @@ def register(data: RegisterRequest):
         if referrer:
             referred_by = referrer['_id']
     
+    return referral_code, referred_by
+
+def _create_user(data: RegisterRequest, password_hash: str, referral_code: str, referred_by) -> Dict:
+    """Insert the new user and credit the referrer (blocking DB work)"""
     # Create user
     user_doc = {
         'email': data.email,
-        'password_hash': hash_password(data.password),
+        'password_hash': password_hash,
         'nickname': data.nickname,
         'role': 'user',
         'avatar_seed': data.nickname[0].upper(),
@@ -244,7 +311,13 @@ def register(data: RegisterRequest):
         'created_at': datetime.utcnow()
     }
     
-    result = users_col.insert_one(user_doc)
+    # The unique email index settles concurrent registrations of one email
+    try:
+        result = users_col.insert_one(user_doc)
+    except DuplicateKeyError as e:
+        if 'email' in (e.details or {}).get('keyPattern', {}):
+            raise HTTPException(status_code=400, detail="Email already registered")
+        raise
     user_doc['_id'] = result.inserted_id
     
     # If referred, increment referrer's count and check for badges
@@ -256,8 +329,28 @@ def register(data: RegisterRequest):
         # Check for referral badges
         _check_referral_badges(referred_by, users_col)
     
+    return user_doc
+
+async def _password_work(coro):
+    """Await a password-pool operation, shedding load when the pool is saturated"""
+    try:
+        return await coro
+    except PasswordPoolBusy:
+        raise HTTPException(
+            status_code=503,
+            detail="Too many sign-in requests, please retry shortly",
+            headers={'Retry-After': '2'}
+        )
+
+@app.post("/api/auth/register", response_model=TokenResponse)
+async def register(data: RegisterRequest):
+    # Database work runs in the threadpool, bcrypt in the password process pool
+    referral_code, referred_by = await run_in_threadpool(_prepare_registration, data)
+    password_hash = await _password_work(hash_password_async(data.password))
+    user_doc = await run_in_threadpool(_create_user, data, password_hash, referral_code, referred_by)
+    
     # Create token
-    token = create_token(str(result.inserted_id), data.email, 'user')
+    token = create_token(str(user_doc['_id']), data.email, 'user')
     
     user_data = serialize_doc(user_doc)
     user_data.pop('password_hash', None)
@@ -269,10 +362,10 @@ def register(data: RegisterRequest):
     }
 
 @app.post("/api/auth/login", response_model=TokenResponse)
-def login(data: LoginRequest):
-    user = users_col.find_one({'email': data.email})
+async def login(data: LoginRequest):
+    user = await run_in_threadpool(users_col.find_one, {'email': data.email}, {'processed_events': 0})
     
-    if not user or not verify_password(data.password, user['password_hash']):
+    if not user or not await _password_work(verify_password_async(data.password, user['password_hash'])):
         raise HTTPException(status_code=401, detail="Invalid credentials")
     
     token = create_token(str(user['_id']), user['email'], user.get('role', 'user'))
@@ -288,8 +381,10 @@ def login(data: LoginRequest):
 
 @app.get("/api/auth/me")
 def get_me(current_user: Dict = Depends(get_current_user)):
-    current_user.pop('password_hash', None)
-    return current_user
+    user = users_col.find_one({'_id': ObjectId(current_user['_id'])}, {'password_hash': 0, 'processed_events': 0})
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+    return serialize_doc(user)
 
 # ============================================================================
 # ADMIN - TOPICS
@@ -300,11 +395,9 @@ def get_topics_admin(current_user: Dict = Depends(get_current_admin)):
     topics = list(topics_col.find())
     
     # Add question count to each topic
+    question_counts = count_active_questions_by_topic()
     for topic in topics:
-        topic['question_count'] = questions_col.count_documents({
-            'topic_id': topic['_id'],
-            'active': True
-        })
+        topic['question_count'] = question_counts.get(topic['_id'], 0)
     
     return {'topics': serialize_doc(topics)}
 
@@ -338,6 +431,9 @@ def update_topic_admin(topic_id: str, data: TopicUpdate, current_user: Dict = De
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Topic not found")
     
+    # Rendered quizzes carry the topic name
+    invalidate_quiz_payloads(topic_id=topic_id)
+    
     topic = topics_col.find_one({'_id': ObjectId(topic_id)})
     return {'topic': serialize_doc(topic)}
 
@@ -353,6 +449,7 @@ def delete_all_topics_and_questions(current_user: Dict = Depends(get_current_adm
         
         # Delete all daily packs (they reference topics)
         packs_result = daily_packs_col.delete_many({})
+        invalidate_quiz_payloads()
         
         return {
             'success': True,
@@ -403,6 +500,9 @@ def bulk_delete_topics_admin(data: BulkTopicOperation, current_user: Dict = Depe
         except Exception as e:
             errors.append({'topic_id': topic_id, 'error': str(e)})
     
+    if deleted_questions:
+        invalidate_quiz_payloads()
+    
     return {
         'success': True,
         'deleted_topics': deleted_topics,
@@ -528,6 +628,9 @@ def update_question_admin(
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Question not found")
     
+    # Rendered quizzes and correct keys of cached packs may have changed
+    invalidate_quiz_payloads(question_id=question_id)
+    
     question = questions_col.find_one({'_id': ObjectId(question_id)})
     return {'question': serialize_doc(question)}
 
@@ -538,6 +641,8 @@ def delete_question_admin(question_id: str, current_user: Dict = Depends(get_cur
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Question not found")
     
+    invalidate_quiz_payloads(question_id=question_id)
+    
     return {'success': True}
 
 # ============================================================================
@@ -584,11 +689,57 @@ def generate_pack_admin(
         raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
     
     try:
+        # generate_daily_pack returns an existing pack unchanged; only a newly
+        # generated one (e.g. after the old one was deleted) may be cached stale elsewhere
+        created = get_pack(pack_date) is None
         pack = generate_daily_pack(pack_date)
-        return {'pack': pack}
+        if created:
+            bump_pack_version()
+        return {'pack': pack, 'created': created}
     except ValueError as e:
         raise HTTPException(status_code=400, detail=str(e))
 
+@app.get("/api/admin/db/pool-stats")
+def get_db_pool_stats_admin(current_user: Dict = Depends(get_current_admin)):
+    """Get MongoDB pool settings and per-server connection counters"""
+    return get_pool_stats()
+
+@app.get("/api/admin/db/indexes")
+def get_db_indexes_admin(refresh: bool = False, current_user: Dict = Depends(get_current_admin)):
+    """
+    Get missing, conflicting and undeclared indexes (refresh re-checks without creating).
+    Entries with 'blocking': true are unique indexes the app relies on for correctness;
+    'ok' is false while any of them is missing or conflicting.
+    """
+    report = get_last_index_report()
+    if refresh or report is None:
+        report = apply_index_registry(create=False)
+    return report
+
+@app.get("/api/admin/auth/password-pool/status")
+def get_password_pool_status_admin(current_user: Dict = Depends(get_current_admin)):
+    """Get queue depth, rejections and timing of the password hashing pool"""
+    return get_password_pool_status()
+
+@app.get("/api/admin/packs/scheduler/status")
+def get_pack_scheduler_status_admin(current_user: Dict = Depends(get_current_admin)):
+    """Get the ahead-of-time pack scheduler state and which upcoming packs exist"""
+    return get_scheduler_status()
+
+@app.post("/api/admin/leaderboards/rebuild")
+def rebuild_leaderboard_admin(
+    date_str: str = Query(..., alias="date"),
+    current_user: Dict = Depends(get_current_admin)
+):
+    """Rebuild the materialized quiz leaderboards and daily totals for a date from stored results"""
+    try:
+        date.fromisoformat(date_str)
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    
+    entries = rebuild_leaderboard(date_str)
+    return {'success': True, 'date': date_str, 'entries_written': entries}
+
 @app.get("/api/admin/packs/{date_str}/questions")
 def get_pack_questions_admin(
     date_str: str,
@@ -633,6 +784,11 @@ def get_pack_questions_admin(
         'total_questions': sum(q['question_count'] for q in quizzes) * 10 + bonus_quiz['question_count']
     }
 
+@app.get("/api/admin/post-submit/status")
+def get_post_submit_status_admin(current_user: Dict = Depends(get_current_admin)):
+    """Get queue depth and outbox counts of the post-submit pipeline"""
+    return get_pipeline_status()
+
 @app.get("/api/admin/metrics")
 def get_metrics_admin(current_user: Dict = Depends(get_current_admin)):
     today = date.today().isoformat()
@@ -683,17 +839,43 @@ def reset_usage_tracking(current_user: Dict = Depends(get_current_admin)):
     """
     result = reset_question_usage()
     
-    # Also delete today's pack so it regenerates with fresh questions
+    # Also delete today's and any precomputed future packs so they regenerate with fresh questions
     today = date.today().isoformat()
-    daily_packs_col.delete_one({'date': today})
+    daily_packs_col.delete_many({'date': {'$gte': today}})
+    invalidate_quiz_payloads(from_date=today)
+    trigger_pack_scheduler()
     
     return {
         'success': True,
         'message': 'Question usage tracker reset. Today\'s pack will regenerate with fresh questions.',
-        'action_taken': 'Deleted today\'s pack to force regeneration'
+        'action_taken': 'Deleted today\'s and upcoming packs to force regeneration'
     }
 
 
+@app.get("/api/admin/questions/capacity-forecast")
+def get_capacity_forecast(
+    days: int = Query(365, ge=1, le=3650),
+    start_date: Optional[str] = Query(None),
+    current_user: Dict = Depends(get_current_admin)
+):
+    """
+    Simulate the next daily packs in memory against the current question bank
+    (nothing is written): days until the bank is exhausted, per-topic
+    depletion and Image Quiz starvation.
+    """
+    try:
+        start = date.fromisoformat(start_date) if start_date else None
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid date format. Use YYYY-MM-DD")
+    
+    try:
+        forecast = simulate_pack_capacity(days=days, start_date=start)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {'success': True, 'forecast': forecast}
+
+
 # ============================================================================
 # ADMIN - IMAGE UPLOAD
 # ============================================================================
@@ -1407,46 +1589,33 @@ def get_notification_stats(current_user: Dict = Depends(get_current_admin)):
 # ============================================================================
 
 @app.get("/api/packs/today")
-def get_today_pack(current_user: Dict = Depends(get_current_user)):
+async def get_today_pack(current_user: Dict = Depends(get_current_user)):
     today = date.today()
     
     try:
-        pack = generate_daily_pack(today)
+        pack = await aio.generate_daily_pack(today)
     except ValueError as e:
         raise HTTPException(status_code=500, detail=str(e))
     
-    # Get user progress for each quiz
+    # Get user progress for every quiz with a single read
     user_id = current_user['_id']
-    today_str = today.isoformat()
+    daily_state = await aio.get_user_daily_state(user_id, today)
+    
+    # Resolve all topic names of the pack with a single query
+    pack_topic_ids = {tid for quiz_data in pack['quizzes'] for tid in quiz_data['topic_ids']}
+    topic_names_by_id = await aio.get_topic_names(list(pack_topic_ids))
     
     quizzes = []
     for quiz_data in pack['quizzes'][:10]:  # First 10 are regular
         idx = quiz_data['index']
         
-        # Get attempt count and lock status
-        attempt_count = get_attempt_count(user_id, today, idx)
-        is_locked = is_quiz_locked(user_id, today, idx)
-        
-        # Get best result
-        result = results_col.find_one({
-            'user_id': ObjectId(user_id),
-            'date': today_str,
-            'quiz_index': idx
-        })
-        
-        best_score = None
-        if result:
-            best_score = {
-                'percentage': result.get('best_pct', 0),
-                'time_ms': result.get('best_time_ms', 0)
-            }
+        # Get attempt count, lock status and best result
+        attempt_count = daily_state[idx]['attempts']
+        is_locked = daily_state[idx]['locked']
+        best_score = daily_state[idx]['best_score']
         
         # Get topic names for this quiz
-        topic_names = []
-        for topic_id in quiz_data['topic_ids']:
-            topic = topics_col.find_one({'_id': ObjectId(topic_id)})
-            if topic:
-                topic_names.append(topic['name'])
+        topic_names = [topic_names_by_id[tid] for tid in quiz_data['topic_ids'] if tid in topic_names_by_id]
         
         quizzes.append({
             'index': idx,
@@ -1460,30 +1629,14 @@ def get_today_pack(current_user: Dict = Depends(get_current_user)):
     
     # Bonus quiz (index 10)
     bonus_data = pack['quizzes'][10]
-    bonus_attempt_count = get_attempt_count(user_id, today, 10)
-    bonus_locked = is_quiz_locked(user_id, today, 10)
-    
-    bonus_result = results_col.find_one({
-        'user_id': ObjectId(user_id),
-        'date': today_str,
-        'quiz_index': 10
-    })
-    
-    bonus_best_score = None
-    if bonus_result:
-        bonus_best_score = {
-            'percentage': bonus_result.get('best_pct', 0),
-            'time_ms': bonus_result.get('best_time_ms', 0)
-        }
+    bonus_attempt_count = daily_state[10]['attempts']
+    bonus_locked = daily_state[10]['locked']
+    bonus_best_score = daily_state[10]['best_score']
     
     # Bonus unlocks when all 10 regular quizzes attempted at least once
     all_completed = all(q['attempt_count'] > 0 for q in quizzes)
     
-    bonus_topic_names = []
-    for topic_id in bonus_data['topic_ids']:
-        topic = topics_col.find_one({'_id': ObjectId(topic_id)})
-        if topic:
-            bonus_topic_names.append(topic['name'])
+    bonus_topic_names = [topic_names_by_id[tid] for tid in bonus_data['topic_ids'] if tid in topic_names_by_id]
     
     bonus_quiz = {
         'index': 10,
@@ -1497,17 +1650,79 @@ def get_today_pack(current_user: Dict = Depends(get_current_user)):
     }
     
     return {
-        'date': today_str,
+        'date': today.isoformat(),
         'quizzes': quizzes,
         'bonus_quiz': bonus_quiz
     }
 
+@app.get("/api/packs/today/bundle")
+async def get_today_pack_bundle(
+    request: Request,
+    lang: str = Query('en', regex='^(en|sk)$'),
+    current_user: Dict = Depends(get_current_user)
+):
+    """
+    All of today's quizzes the user can still play, with the questions of their
+    next attempt (no correct keys), in one gzip-compressed response.
+    The ETag changes when the user's progress or the pack changes, so clients
+    can revalidate with If-None-Match and get 304 until then.
+    """
+    today = date.today()
+    today_str = today.isoformat()
+    
+    try:
+        pack = await aio.generate_daily_pack(today)
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
+    
+    user_id = current_user['_id']
+    daily_state = await aio.get_user_daily_state(user_id, today)
+    
+    # Playable quizzes and the attempt each would be
+    bonus_unlocked = all(slot['attempts'] > 0 for slot in daily_state[:10])
+    playable = [
+        (quiz_data['index'], daily_state[quiz_data['index']]['attempts'] + 1)
+        for quiz_data in pack['quizzes']
+        if not daily_state[quiz_data['index']]['locked']
+        and daily_state[quiz_data['index']]['attempts'] < 3
+        and (quiz_data['index'] < 10 or bonus_unlocked)
+    ]
+    
+    etag_source = json.dumps([today_str, lang, await aio.get_pack_version(), playable])
+    etag = '"' + hashlib.sha1(etag_source.encode()).hexdigest() + '"'
+    headers = {'ETag': etag, 'Cache-Control': 'private, no-cache', 'Vary': 'Accept-Encoding'}
+    
+    if request.headers.get('if-none-match') == etag:
+        return Response(status_code=304, headers=headers)
+    
+    bundle = {
+        'date': today_str,
+        'lang': lang,
+        'quizzes': [
+            {
+                'quiz_index': quiz_index,
+                'topic_count': len(pack['quizzes'][quiz_index]['topic_ids']),
+                'questions': await aio.get_quiz_for_attempt(today, quiz_index, lang, next_attempt),
+                'attempt_number': next_attempt,
+                'attempts_remaining': 3 - next_attempt
+            }
+            for quiz_index, next_attempt in playable
+        ]
+    }
+    
+    body = json.dumps(bundle, separators=(',', ':')).encode()
+    if 'gzip' in request.headers.get('accept-encoding', ''):
+        body = gzip.compress(body)
+        headers['Content-Encoding'] = 'gzip'
+    
+    return Response(content=body, media_type='application/json', headers=headers)
+
 # ============================================================================
 # USER - QUIZ TAKING
 # ============================================================================
 
 @app.get("/api/quizzes/{quiz_index}")
-def get_quiz(
+async def get_quiz(
     quiz_index: int,
     lang: str = Query('en', regex='^(en|sk)$'),
     current_user: Dict = Depends(get_current_user)
@@ -1517,20 +1732,23 @@ def get_quiz(
     
     user_id = current_user['_id']
     today = date.today()
-    today_str = today.isoformat()
+    daily_state = await aio.get_user_daily_state(user_id, today)
     
     # Check if quiz is locked
-    if is_quiz_locked(user_id, today, quiz_index):
+    if daily_state[quiz_index]['locked']:
         raise HTTPException(status_code=403, detail="Quiz is locked after viewing answers")
     
     # Get attempt count
-    attempt_count = get_attempt_count(user_id, today, quiz_index)
+    attempt_count = daily_state[quiz_index]['attempts']
     
     if attempt_count >= 3:
         raise HTTPException(status_code=403, detail="Maximum 3 attempts reached")
     
     # Get pack
-    pack = generate_daily_pack(today)
+    try:
+        pack = await aio.generate_daily_pack(today)
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     
     # Get quiz data
     quiz_data = pack['quizzes'][quiz_index]
@@ -1538,18 +1756,13 @@ def get_quiz(
     
     # Check bonus unlock
     if quiz_index == 10:
-        regular_attempts = [get_attempt_count(user_id, today, i) for i in range(10)]
-        if not all(count > 0 for count in regular_attempts):
+        if not all(slot['attempts'] > 0 for slot in daily_state[:10]):
             raise HTTPException(status_code=403, detail="Complete all 10 quizzes to unlock bonus")
     
-    # Get questions with randomized options (30 questions from 10 topics)
-    # Pass pack_date and quiz_index to use pre-selected questions (no-repeat logic)
+    # Prerendered questions of the pack's quiz (30 questions from 10 topics, no correct keys),
+    # with this attempt's option order
     next_attempt = attempt_count + 1
-    questions = get_quiz_questions(topic_ids, next_attempt, lang, pack_date=today, quiz_index=quiz_index)
-    
-    # Remove correct_key from questions (only show after viewing answers)
-    for q in questions:
-        q.pop('correct_key', None)
+    questions = await aio.get_quiz_for_attempt(today, quiz_index, lang, next_attempt)
     
     return {
         'quiz_index': quiz_index,
@@ -1572,65 +1785,72 @@ def submit_quiz(
     user_id = current_user['_id']
     today = date.today()
     
-    # Check if quiz is locked
-    if is_quiz_locked(user_id, today, quiz_index):
-        raise HTTPException(status_code=403, detail="Quiz is locked after viewing answers")
-    
-    # Get attempt count
-    attempt_count = get_attempt_count(user_id, today, quiz_index)
-    
-    if attempt_count >= 3:
-        raise HTTPException(status_code=403, detail="Maximum 3 attempts reached")
-    
     # Validate answer count (should be 30 questions now)
     # Allow submission even if some are unanswered (marked as 'UNANSWERED')
     if len(data.answers) != 30:
         raise HTTPException(status_code=400, detail="Must submit exactly 30 answers")
     
+    # Atomically reserve the attempt the questions were served for
+    # (enforces lock and 3-attempt limit; answers use that attempt's option order)
+    next_attempt = reserve_attempt_slot(user_id, today, quiz_index, expected_attempt=data.attempt_number)
+    if next_attempt is None:
+        slot_state = get_user_daily_state(user_id, today)[quiz_index]
+        if slot_state['locked']:
+            raise HTTPException(status_code=403, detail="Quiz is locked after viewing answers")
+        if slot_state['attempts'] >= 3:
+            raise HTTPException(status_code=403, detail="Maximum 3 attempts reached")
+        raise HTTPException(
+            status_code=409,
+            detail=f"Answers are for attempt {data.attempt_number} but the next attempt is "
+                   f"{slot_state['attempts'] + 1}; reload the quiz"
+        )
+    
     # Record attempt
-    next_attempt = attempt_count + 1
-    result = record_attempt(
+    try:
+        result = record_attempt(
+            user_id=user_id,
+            pack_date=today,
+            quiz_index=quiz_index,
+            attempt_num=next_attempt,
+            answers=[a.dict() for a in data.answers],
+            time_ms=data.time_ms,
+            nickname=current_user.get('nickname'),
+            slot_reserved=True,
+            displayed_keys=True,
+            post_submit=True
+        )
+    except Exception:
+        # Give the slot back only if the attempt itself was never written
+        attempt_written = attempts_col.count_documents({
+            'user_id': ObjectId(user_id),
+            'date': today.isoformat(),
+            'quiz_index': quiz_index,
+            'attempt_num': next_attempt
+        }, limit=1)
+        if not attempt_written:
+            release_attempt_slot(user_id, today, quiz_index)
+        raise
+    
+    # Stats, auto-lock after 3rd attempt and badges run in the post-submit pipeline
+    # (the attempt is marked pending, so the sweeper enqueues it if we crash here)
+    enqueue_post_submit(
+        attempt_id=result['attempt_id'],
         user_id=user_id,
-        pack_date=today,
+        pack_date=today.isoformat(),
         quiz_index=quiz_index,
         attempt_num=next_attempt,
-        answers=[a.dict() for a in data.answers],
+        correct_count=result['score']['correct_count'],
         time_ms=data.time_ms
     )
     
-    # Auto-lock quiz after 3rd attempt
-    if next_attempt >= 3:
-        lock_quiz_after_answers(user_id, today, quiz_index)
-    
-    # Update user stats
-    users_col.update_one(
-        {'_id': ObjectId(user_id)},
-        {'$inc': {'stats.quizzes_played': 1}}
-    )
-    
-    # Get leaderboard rank
-    leaderboard = compute_leaderboard(today, quiz_index)
-    rank = None
-    for idx, entry in enumerate(leaderboard):
-        if entry['user_id'] == user_id:
-            rank = entry['rank']
-            break
+    # Get leaderboard rank (indexed count of strictly-better results)
+    rank = get_user_rank(user_id, today, quiz_index)
     
     # Check if perfect score
     is_perfect = result['score']['percentage'] == 100
     
-    # Check and award badges
-    newly_earned_badges = check_and_award_badges(
-        user_id=ObjectId(user_id),
-        quiz_index=quiz_index,
-        score=result['score']['correct_count'],
-        time_ms=data.time_ms,
-        users_col=users_col,
-        results_col=results_col,
-        daily_packs_col=daily_packs_col
-    )
-    
     return {
+        'attempt_id': result['attempt_id'],
         'attempt_number': next_attempt,
         'score': result['score'],
         'is_best': result['is_best'],
@@ -1639,7 +1859,23 @@ def submit_quiz(
         'can_view_answers': True,  # Can always view answers after submitting
         'is_perfect': is_perfect,
         'quiz_locked': next_attempt >= 3,  # Quiz locked after 3rd attempt
-        'badges_earned': newly_earned_badges  # New badges earned from this quiz
+        'badges_earned': [],  # Awarded asynchronously, fetch via /api/attempts/{attempt_id}/badges
+        'badges_pending': True
+    }
+
+
+@app.get("/api/attempts/{attempt_id}/badges")
+def get_attempt_badges(attempt_id: str, current_user: Dict = Depends(get_current_user)):
+    """Get badges earned by a submitted attempt once post-submit processing has finished"""
+    outcome = get_post_submit_result(attempt_id, current_user['_id'])
+    if outcome is None:
+        raise HTTPException(status_code=404, detail="Attempt not found")
+    
+    return {
+        'attempt_id': attempt_id,
+        'status': outcome['status'],
+        'badges_pending': outcome['status'] in ('pending', 'processing'),
+        'badges_earned': outcome['badges_earned']
     }
 
 @app.get("/api/quizzes/{quiz_index}/answers")
@@ -1648,16 +1884,22 @@ def get_quiz_answers(
     lang: str = Query('en', regex='^(en|sk)$'),
     current_user: Dict = Depends(get_current_user)
 ):
+    if quiz_index < 0 or quiz_index > 10:
+        raise HTTPException(status_code=400, detail="Quiz index must be 0-10")
+    
     user_id = current_user['_id']
     today = date.today()
     
     # Can view answers after any attempt (warning shown in frontend for attempts < 3)
-    attempt_count = get_attempt_count(user_id, today, quiz_index)
+    attempt_count = get_user_daily_state(user_id, today)[quiz_index]['attempts']
     if attempt_count < 1:
         raise HTTPException(status_code=403, detail="Complete at least 1 attempt to view answers")
     
     # Get pack and quiz data
-    pack = generate_daily_pack(today)
+    try:
+        pack = generate_daily_pack(today)
+    except ValueError as e:
+        raise HTTPException(status_code=500, detail=str(e))
     quiz_data = pack['quizzes'][quiz_index]
     topic_ids = quiz_data['topic_ids']
     
@@ -1680,10 +1922,15 @@ def get_quiz_answers(
         for ans in last_attempt.get('answers', []):
             user_answers[ans['question_id']] = ans['choice_key']
     
-    # Add user's answer and correctness to each question
+    # Show options in the order of the last attempt; stored answers are canonical keys
+    displayed_questions = []
     for q in questions:
-        q['user_answer'] = user_answers.get(q['_id'])
+        order = get_option_order(today, q['_id'], attempt_count)
+        q = apply_option_order(q, order)
+        q['user_answer'] = to_displayed_key(user_answers.get(q['_id']), order)
         q['is_correct'] = q['user_answer'] == q['correct_key'] if q['user_answer'] else False
+        displayed_questions.append(q)
+    questions = displayed_questions
     
     return {'questions': questions}
 
@@ -1703,76 +1950,92 @@ def lock_quiz(
     return {'success': success, 'locked': True, 'penalty_applied': False}
 
 @app.get("/api/quizzes/{quiz_index}/leaderboard")
-def get_quiz_leaderboard(
+async def get_quiz_leaderboard(
     quiz_index: int,
     group_id: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
     current_user: Dict = Depends(get_current_user)
 ):
     today = date.today()
     
-    leaderboard = compute_leaderboard(today, quiz_index, group_id)
+    try:
+        page = await aio.get_leaderboard_page(today, quiz_index, limit=limit, cursor=cursor, group_id=group_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    return {
+        'date': today.isoformat(),
+        'quiz_index': quiz_index,
+        'leaderboard': page['leaderboard'],
+        'next_cursor': page['next_cursor'],
+        'current_user_id': current_user['_id']
+    }
+
+
+@app.get("/api/quizzes/{quiz_index}/leaderboard/around-me")
+def get_quiz_leaderboard_around_me(
+    quiz_index: int,
+    radius: int = Query(5, ge=0, le=50),
+    group_id: Optional[str] = Query(None),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Get the caller's rank and the players just above and below them"""
+    today = date.today()
+    
+    window = get_leaderboard_around_user(current_user['_id'], today, quiz_index, radius, group_id)
     
     return {
         'date': today.isoformat(),
         'quiz_index': quiz_index,
-        'leaderboard': leaderboard,
+        'rank': window['rank'],
+        'leaderboard': window['leaderboard'],
         'current_user_id': current_user['_id']
     }
 
 
 @app.get("/api/rankings/daily")
-def get_daily_overall_leaderboard(
+async def get_daily_overall_leaderboard(
     group_id: Optional[str] = Query(None),
+    limit: int = Query(100, ge=1, le=500),
+    cursor: Optional[str] = Query(None),
     current_user: Dict = Depends(get_current_user)
 ):
     """
     Get overall daily challenge leaderboard.
-    Rankings based on: total percentage across all completed quizzes, then total time.
+    Rankings based on: average percentage across all completed quizzes, then total time.
+    Served from the incrementally maintained daily totals, paginated with limit/cursor.
     """
     today = date.today()
-    today_str = today.isoformat()
-    
-    # Build filter
-    query = {'date': today_str}
-    
-    # Filter by group if provided
-    if group_id:
-        group = groups_col.find_one({'_id': ObjectId(group_id)})
-        if group and 'members' in group:
-            query['user_id'] = {'$in': group['members']}
     
-    # Aggregate results per user for today
-    pipeline = [
-        {'$match': query},
-        {'$group': {
-            '_id': '$user_id',
-            'total_pct': {'$sum': '$best_pct'},
-            'total_time_ms': {'$sum': '$best_time_ms'},
-            'quizzes_completed': {'$sum': 1},
-            'avg_pct': {'$avg': '$best_pct'}
-        }},
-        {'$sort': {'avg_pct': -1, 'total_time_ms': 1}}
-    ]
+    try:
+        page = await aio.get_daily_ranking_page(today, limit=limit, cursor=cursor, group_id=group_id)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    aggregated = list(results_col.aggregate(pipeline))
+    return {
+        'date': today.isoformat(),
+        'leaderboard': page['leaderboard'],
+        'next_cursor': page['next_cursor'],
+        'current_user_id': current_user['_id']
+    }
+
+
+@app.get("/api/rankings/daily/around-me")
+def get_daily_leaderboard_around_me(
+    radius: int = Query(5, ge=0, le=50),
+    group_id: Optional[str] = Query(None),
+    current_user: Dict = Depends(get_current_user)
+):
+    """Get the caller's overall daily rank and the players just above and below them"""
+    today = date.today()
     
-    leaderboard = []
-    for idx, entry in enumerate(aggregated):
-        user = users_col.find_one({'_id': entry['_id']})
-        
-        leaderboard.append({
-            'rank': idx + 1,
-            'user_id': str(entry['_id']),
-            'nickname': user['nickname'] if user else 'Unknown',
-            'quizzes_completed': entry['quizzes_completed'],
-            'avg_percentage': round(entry['avg_pct'], 2),
-            'total_percentage': round(entry['total_pct'], 2),
-            'total_time_ms': entry['total_time_ms']
-        })
+    window = get_daily_ranking_around_user(current_user['_id'], today, radius, group_id)
     
     return {
-        'date': today_str,
-        'leaderboard': leaderboard,
+        'date': today.isoformat(),
+        'rank': window['rank'],
+        'leaderboard': window['leaderboard'],
         'current_user_id': current_user['_id']
     }
 
@@ -2049,6 +2312,9 @@ def get_all_badges():
 
 @app.on_event("startup")
 async def startup_event():
+    # Password hashing workers (spawned, so nothing of this process is inherited)
+    start_password_pool()
+    
     # Create admin user if not exists
     admin = users_col.find_one({'email': 'admin@socraquest.sk'})
     if not admin:
@@ -2064,6 +2330,25 @@ async def startup_event():
         }
         users_col.insert_one(admin_doc)
         print("✅ Admin user created: admin@socraquest.sk")
+    
+    # Create missing indexes; conflicts are only reported (migrate_results_index.py replaces them)
+    try:
+        print_index_report(await run_in_threadpool(apply_index_registry))
+    except Exception as e:
+        print(f"❌ Index bootstrap failed: {e}")
+    
+    # Start post-submit workers (stats, auto-lock, badges)
+    start_workers()
+    
+    # Generate upcoming daily packs ahead of time
+    start_scheduler()
+
+@app.on_event("shutdown")
+def shutdown_event():
+    stop_workers()
+    stop_scheduler()
+    shutdown_password_pool()
+    close_clients()
 
 @app.get("/api/health")
 def health_check():
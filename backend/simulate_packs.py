@@ -0,0 +1,50 @@
+"""
+Forecast the question bank's capacity for SocraQuest daily packs.
+Runs the pack generator in memory for the coming days; nothing is written.
+
+Usage:
+    python simulate_packs.py [days] [start_date YYYY-MM-DD]
+"""
+import sys
+from datetime import date
+
+from core_services import simulate_pack_capacity
+
+
+def print_forecast(forecast):
+    print(f"📦 Simulated {forecast['days']} packs from {forecast['start_date']}")
+    print(f"   Questions: {forecast['total_questions']} total, {forecast['unused_at_start']} unused, "
+          f"{forecast['questions_per_pack']} per pack")
+
+    if forecast['days_until_exhaustion'] is None:
+        print("✅ Unused questions last for the whole simulation")
+    else:
+        print(f"🔄 Bank exhausted after {forecast['days_until_exhaustion']} days "
+              f"({len(forecast['cycle_resets'])} cycle resets: {', '.join(forecast['cycle_resets'][:5])}"
+              f"{'...' if len(forecast['cycle_resets']) > 5 else ''})")
+
+    if forecast['repeat_days']:
+        print(f"⚠️  {len(forecast['repeat_days'])} packs repeat questions within a cycle "
+              f"(first: {forecast['repeat_days'][0]})")
+
+    short_topics = [t for t in forecast['topics'] if t['first_short_date']]
+    if short_topics:
+        print(f"\n📉 Topics running short of unused questions ({len(short_topics)}):")
+        for topic in short_topics[:20]:
+            print(f"   {topic['first_short_date']}  {topic['name']} "
+                  f"({topic['questions']} questions, short on {topic['short_days']} days)")
+
+    image_quiz = forecast['image_quiz']
+    if not image_quiz['topic_id']:
+        print("\n🖼️  No active 'Image Quiz' topic - quiz 5 never gets an image round")
+    else:
+        print(f"\n🖼️  Image Quiz: {image_quiz['questions']} questions, "
+              f"missing on {image_quiz['missing_days']} days, repeating on {image_quiz['repeat_days']} days")
+        if image_quiz['first_repeat_date']:
+            print(f"   First repeat: {image_quiz['first_repeat_date']}")
+
+
+if __name__ == '__main__':
+    days = int(sys.argv[1]) if len(sys.argv) > 1 else 365
+    start_date = date.fromisoformat(sys.argv[2]) if len(sys.argv) > 2 else None
+    print_forecast(simulate_pack_capacity(days=days, start_date=start_date))
@@ -0,0 +1,288 @@
+"""
+Post-Submit Event Pipeline for SocraQuest
+Runs quiz-submit side effects (stats, auto-lock, badges) off the request path.
+
+Every submit writes its attempt marked 'post_submit_pending', then one event
+(keyed by the attempt id) to the durable 'post_submit_events' outbox, clears
+the mark and pushes the event id onto an in-process queue. Worker threads claim events atomically,
+run each step once (completed steps are recorded on the event, so a replay
+after a crash skips them) and store the earned badges on the event, where
+clients can fetch them afterwards. A sweeper re-queues events left behind by
+a crashed or restarted worker process, and enqueues the events of attempts
+still marked pending (a crash between the attempt and its event).
+"""
+import os
+import queue
+import threading
+import traceback
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional, Any
+from bson import ObjectId
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+from core_services import (
+    lock_quiz_after_answers,
+    serialize_doc,
+    MAX_ATTEMPTS,
+    users_col,
+    results_col,
+    attempts_col,
+    daily_packs_col,
+    post_submit_events_col
+)
+from badge_service import check_and_award_badges
+
+WORKER_COUNT = int(os.environ.get('POST_SUBMIT_WORKERS', '2'))
+SWEEP_INTERVAL_SECONDS = 30
+CLAIM_TIMEOUT_SECONDS = 120  # A 'processing' event older than this is considered abandoned
+MAX_EVENT_ATTEMPTS = 5
+PROCESSED_EVENTS_KEPT = 50  # Per user; replays happen within minutes, long before 50 newer submits
+
+_event_queue: "queue.Queue[ObjectId]" = queue.Queue()
+_stop_event = threading.Event()
+_threads: List[threading.Thread] = []
+
+
+def enqueue_post_submit(attempt_id: str, user_id: str, pack_date: str, quiz_index: int,
+                        attempt_num: int, correct_count: int, time_ms: int) -> str:
+    """
+    Record the side effects of a submitted attempt in the outbox and queue them.
+    Idempotent: the event id is the attempt id, so enqueueing twice (e.g. the
+    request and the sweeper) writes one event.
+
+    Returns:
+        The event id
+    """
+    event_id = ObjectId(attempt_id)
+    event = {
+        '_id': event_id,
+        'attempt_id': attempt_id,
+        'user_id': ObjectId(user_id),
+        'date': pack_date,
+        'quiz_index': quiz_index,
+        'attempt_num': attempt_num,
+        'correct_count': correct_count,
+        'time_ms': time_ms,
+        'status': 'pending',
+        'steps_done': [],
+        'badges_earned': [],
+        'attempts': 0,
+        'created_at': datetime.utcnow()
+    }
+    try:
+        post_submit_events_col.insert_one(event)
+    except DuplicateKeyError:
+        pass  # Already in the outbox
+    attempts_col.update_one({'_id': event_id}, {'$unset': {'post_submit_pending': ''}})
+    _event_queue.put(event_id)
+    return attempt_id
+
+
+def get_post_submit_result(attempt_id: str, user_id: str) -> Optional[Dict[str, Any]]:
+    """
+    Get the outcome of an attempt's post-submit processing.
+
+    Returns:
+        {'status': 'pending' | 'processing' | 'done' | 'failed', 'badges_earned': [...]}
+        or None if there is no event for this attempt and user
+    """
+    event = post_submit_events_col.find_one(
+        {'attempt_id': attempt_id, 'user_id': ObjectId(user_id)},
+        {'status': 1, 'badges_earned': 1}
+    )
+    if not event:
+        return None
+
+    return {
+        'status': event['status'],
+        'badges_earned': serialize_doc(event.get('badges_earned', []))
+    }
+
+
+def _claim_event(event_id: ObjectId) -> Optional[Dict]:
+    """Atomically take ownership of an event (pending, or abandoned while processing)"""
+    stale_before = datetime.utcnow() - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)
+    return post_submit_events_col.find_one_and_update(
+        {
+            '_id': event_id,
+            '$or': [
+                {'status': 'pending'},
+                {'status': 'processing', 'claimed_at': {'$lt': stale_before}}
+            ]
+        },
+        {
+            '$set': {'status': 'processing', 'claimed_at': datetime.utcnow()},
+            '$inc': {'attempts': 1}
+        },
+        return_document=ReturnDocument.AFTER
+    )
+
+
+def _mark_step_done(event_id: ObjectId, step: str, extra_set: Optional[Dict] = None):
+    update = {'$addToSet': {'steps_done': step}}
+    if extra_set:
+        update['$set'] = extra_set
+    post_submit_events_col.update_one({'_id': event_id}, update)
+
+
+def _process_event(event: Dict) -> None:
+    """Run every step of an event that has not completed yet"""
+    event_id = event['_id']
+    user_oid = event['user_id']
+    steps_done = set(event.get('steps_done', []))
+
+    # 1. User stats (the user's recent event ids make the increment apply once
+    # even if we crash before marking the step)
+    if 'stats' not in steps_done:
+        users_col.update_one(
+            {'_id': user_oid, 'processed_events': {'$ne': event_id}},
+            {
+                '$inc': {'stats.quizzes_played': 1},
+                '$push': {'processed_events': {'$each': [event_id], '$slice': -PROCESSED_EVENTS_KEPT}}
+            }
+        )
+        _mark_step_done(event_id, 'stats')
+
+    # 2. Auto-lock quiz after the last attempt
+    if 'lock' not in steps_done:
+        if event['attempt_num'] >= MAX_ATTEMPTS:
+            lock_quiz_after_answers(str(user_oid), event['date'], event['quiz_index'])
+        _mark_step_done(event_id, 'lock')
+
+    # 3. Badges
+    if 'badges' not in steps_done:
+        newly_earned_badges = check_and_award_badges(
+            user_id=user_oid,
+            quiz_index=event['quiz_index'],
+            score=event['correct_count'],
+            time_ms=event['time_ms'],
+            users_col=users_col,
+            results_col=results_col,
+            daily_packs_col=daily_packs_col
+        )
+        _mark_step_done(event_id, 'badges', {'badges_earned': newly_earned_badges})
+
+    post_submit_events_col.update_one(
+        {'_id': event_id},
+        {'$set': {'status': 'done', 'completed_at': datetime.utcnow()}}
+    )
+
+
+def _handle_event(event_id: ObjectId) -> None:
+    event = _claim_event(event_id)
+    if not event:
+        return  # Already done, or being processed by another worker
+
+    try:
+        _process_event(event)
+    except Exception as e:
+        traceback.print_exc()
+        status = 'failed' if event['attempts'] >= MAX_EVENT_ATTEMPTS else 'pending'
+        post_submit_events_col.update_one(
+            {'_id': event_id},
+            {'$set': {'status': status, 'error': str(e)}}
+        )
+        print(f"❌ Post-submit event {event_id} failed (attempt {event['attempts']}): {e}")
+
+
+def _worker_loop() -> None:
+    while not _stop_event.is_set():
+        try:
+            event_id = _event_queue.get(timeout=1)
+        except queue.Empty:
+            continue
+        try:
+            _handle_event(event_id)
+        finally:
+            _event_queue.task_done()
+
+
+def _sweep_outbox() -> int:
+    """Re-queue events that are still pending or were abandoned mid-processing,
+    and enqueue attempts whose event was never written"""
+    now = datetime.utcnow()
+    stale_processing = now - timedelta(seconds=CLAIM_TIMEOUT_SECONDS)
+    # Give freshly enqueued events a moment to be picked up by their own process
+    stale_pending = now - timedelta(seconds=SWEEP_INTERVAL_SECONDS)
+
+    requeued = 0
+    for event in post_submit_events_col.find(
+        {'$or': [
+            {'status': 'pending', 'created_at': {'$lt': stale_pending}},
+            {'status': 'processing', 'claimed_at': {'$lt': stale_processing}}
+        ]},
+        {'_id': 1}
+    ).limit(1000):
+        _event_queue.put(event['_id'])
+        requeued += 1
+
+    for attempt in attempts_col.find(
+        {'post_submit_pending': True, 'finished_at': {'$lt': stale_pending}},
+        {'user_id': 1, 'date': 1, 'quiz_index': 1, 'attempt_num': 1, 'correct_count': 1, 'time_ms': 1}
+    ).limit(1000):
+        enqueue_post_submit(
+            attempt_id=str(attempt['_id']),
+            user_id=str(attempt['user_id']),
+            pack_date=attempt['date'],
+            quiz_index=attempt['quiz_index'],
+            attempt_num=attempt['attempt_num'],
+            correct_count=attempt['correct_count'],
+            time_ms=attempt['time_ms']
+        )
+        requeued += 1
+    return requeued
+
+
+def _sweeper_loop() -> None:
+    while not _stop_event.wait(SWEEP_INTERVAL_SECONDS):
+        try:
+            requeued = _sweep_outbox()
+            if requeued:
+                print(f"🔁 Re-queued {requeued} post-submit events")
+        except Exception as e:
+            print(f"⚠️ Post-submit outbox sweep failed: {e}")
+
+
+def start_workers(worker_count: int = WORKER_COUNT) -> None:
+    """Start the worker and sweeper threads (idempotent)"""
+    if _threads:
+        return
+
+    _stop_event.clear()
+    for idx in range(worker_count):
+        thread = threading.Thread(target=_worker_loop, name=f'post-submit-worker-{idx}', daemon=True)
+        thread.start()
+        _threads.append(thread)
+
+    sweeper = threading.Thread(target=_sweeper_loop, name='post-submit-sweeper', daemon=True)
+    sweeper.start()
+    _threads.append(sweeper)
+
+    print(f"✅ Post-submit pipeline started with {worker_count} workers")
+
+
+def stop_workers(timeout: float = 5.0) -> None:
+    """Signal all pipeline threads to stop and wait for them"""
+    _stop_event.set()
+    for thread in _threads:
+        thread.join(timeout=timeout)
+    _threads.clear()
+
+
+def get_pipeline_status() -> Dict[str, Any]:
+    """Queue depth and outbox counts for monitoring"""
+    counts = {
+        row['_id']: row['count']
+        for row in post_submit_events_col.aggregate([
+            {'$match': {'status': {'$in': ['pending', 'processing', 'failed']}}},
+            {'$group': {'_id': '$status', 'count': {'$sum': 1}}}
+        ])
+    }
+    return {
+        'workers': len([t for t in _threads if t.name.startswith('post-submit-worker')]),
+        'queue_depth': _event_queue.qsize(),
+        'pending': counts.get('pending', 0),
+        'processing': counts.get('processing', 0),
+        'failed': counts.get('failed', 0)
+    }
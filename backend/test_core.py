@@ -9,6 +9,11 @@ POC User Stories:
 4. As a user, after 3 attempts I can view correct answers and the quiz becomes locked.
 5. As a user, I see my rank computed by % correct, then faster time.
 6. As an admin, I can generate a pack deterministically for a given date (same topics).
+7. As a user, my answers are scored against the option order I was shown.
+8. As a user, each attempt is reserved atomically, and a failed one is given back.
+9. As a user, only my best result counts (% correct, then faster time).
+10. As a user, I can page through a leaderboard and see the players around me.
+11. As an operator, a legacy usage tracker is migrated onto the questions.
 """
 import sys
 import time
@@ -19,12 +24,25 @@ from bson import ObjectId
 from core_services import (
     generate_daily_pack,
     get_quiz_questions,
+    get_quiz_payload,
+    get_quiz_for_attempt,
     score_attempt,
     record_attempt,
     compute_leaderboard,
     lock_quiz_after_answers,
     get_attempt_count,
     is_quiz_locked,
+    reserve_attempt_slot,
+    release_attempt_slot,
+    upsert_best_result,
+    get_leaderboard_page,
+    get_leaderboard_around_user,
+    get_usage_cycle,
+    MAX_ATTEMPTS,
+    get_pack_answer_keys,
+    get_option_order,
+    to_displayed_key,
+    OPTION_KEYS,
     create_indexes,
     db,
     users_col,
@@ -32,7 +50,10 @@ from core_services import (
     questions_col,
     daily_packs_col,
     attempts_col,
-    results_col
+    results_col,
+    leaderboard_col,
+    daily_totals_col,
+    used_questions_col
 )
 from seed_data import seed_database
 
@@ -50,6 +71,9 @@ def setup():
     db.drop_collection('daily_packs')
     db.drop_collection('attempts')
     db.drop_collection('results')
+    db.drop_collection('leaderboards')
+    db.drop_collection('daily_totals')
+    db.drop_collection('user_daily_state')
     db.drop_collection('users')
     db.drop_collection('groups')
     
@@ -122,44 +146,45 @@ def test_story_2_answer_shuffling():
     
     today = date.today()
     pack = generate_daily_pack(today)
+    quiz_index = 0
     
-    # Get first topic
-    topic_id = pack['quiz_topic_ids'][0]
-    
-    # Get questions for attempt 1
-    questions_attempt1 = get_quiz_questions(topic_id, attempt_num=1)
-    
-    # Get questions for attempt 2 (should have different order)
-    questions_attempt2 = get_quiz_questions(topic_id, attempt_num=2)
-    
-    # Verify we got 3 questions each time
-    assert len(questions_attempt1) == 3, f"Should get 3 questions, got {len(questions_attempt1)}"
-    assert len(questions_attempt2) == 3, f"Should get 3 questions, got {len(questions_attempt2)}"
+    # Canonical questions, and as displayed on attempts 1 and 2
+    canonical = get_quiz_payload(today, quiz_index, 'en')
+    questions_attempt1 = get_quiz_for_attempt(today, quiz_index, 'en', attempt_num=1)
+    questions_attempt2 = get_quiz_for_attempt(today, quiz_index, 'en', attempt_num=2)
     
-    # Verify same questions but potentially different order
-    q1_ids = sorted([q['_id'] for q in questions_attempt1])
-    q2_ids = sorted([q['_id'] for q in questions_attempt2])
-    assert q1_ids == q2_ids, "Should be same questions across attempts"
+    # Same questions, in the same order, on every attempt
+    canonical_ids = [q['_id'] for q in canonical]
+    assert [q['_id'] for q in questions_attempt1] == canonical_ids, "Attempt 1 should show the quiz's questions"
+    assert [q['_id'] for q in questions_attempt2] == canonical_ids, "Attempt 2 should show the quiz's questions"
     
-    # Check that at least one question has different option order
+    # Options are the canonical options permuted by the pack's option order
+    # for the attempt, relabeled A-D
     different_order = False
-    for i in range(3):
-        q1_opts = [o['key'] for o in questions_attempt1[i]['options']]
-        q2_opts = [o['key'] for o in questions_attempt2[i]['options']]
+    for i, question in enumerate(canonical):
+        by_key = {o['key']: o for o in question['options']}
+        orders = pack['option_orders'][question['_id']]
+        
+        for attempt_num, displayed in ((1, questions_attempt1[i]), (2, questions_attempt2[i])):
+            order = orders[attempt_num - 1]
+            assert sorted(order) == sorted(by_key), f"Order {order} should be a permutation of the options"
+            assert [o['key'] for o in displayed['options']] == list(OPTION_KEYS[:len(order)]), \
+                "Displayed options should be relabeled A-D"
+            assert [o['label'] for o in displayed['options']] == [by_key[k]['label'] for k in order], \
+                f"Attempt {attempt_num} should show the options in order {order}"
         
-        if q1_opts != q2_opts:
+        if orders[0] != orders[1] and not different_order:
             different_order = True
             print(f"   Question {i+1}:")
-            print(f"     Attempt 1 order: {q1_opts}")
-            print(f"     Attempt 2 order: {q2_opts}")
-            break
+            print(f"     Attempt 1 order: {orders[0]}")
+            print(f"     Attempt 2 order: {orders[1]}")
     
     assert different_order, "At least one question should have different option order between attempts"
     
     print("✅ Answer options are randomized per attempt")
     print("✅ STORY 2: PASS")
     
-    return topic_id
+    return quiz_index
 
 
 def test_story_3_attempt_cap(user_ids):
@@ -375,6 +400,228 @@ def test_story_6_deterministic_generation():
     print("✅ STORY 6: PASS")
 
 
+def test_story_7_displayed_key_scoring(user_ids):
+    """
+    Story 7: As a user, my answers are scored against the option order
+    I was shown on that attempt.
+    """
+    print("\n" + "=" * 60)
+    print("📖 TEST STORY 7: Scoring Displayed Keys Per Attempt")
+    print("=" * 60)
+    
+    today = date.today()
+    pack = generate_daily_pack(today)
+    user_id = user_ids[2]
+    quiz_index = 2
+    answer_keys = get_pack_answer_keys(today)
+    question_ids = [q_id for q_ids in pack['quizzes'][quiz_index]['question_ids'] for q_id in q_ids]
+    
+    for attempt_num in (1, 2):
+        # Correct answers for the first 10 questions, as displayed on this attempt
+        answers = []
+        for i, q_id in enumerate(question_ids):
+            order = get_option_order(today, q_id, attempt_num)
+            correct_key = to_displayed_key(answer_keys[q_id], order)
+            if i >= 10:
+                correct_key = next(k for k in OPTION_KEYS if k != correct_key)
+            answers.append({'question_id': q_id, 'choice_key': correct_key})
+        
+        result = record_attempt(
+            user_id=user_id,
+            pack_date=today,
+            quiz_index=quiz_index,
+            attempt_num=attempt_num,
+            answers=answers,
+            time_ms=30000,
+            displayed_keys=True
+        )
+        
+        expected = 10 / len(question_ids) * 100
+        actual = result['score']['percentage']
+        assert abs(actual - expected) < 0.01, f"Attempt {attempt_num}: expected {expected:.1f}%, got {actual:.1f}%"
+        
+        # Stored answers are canonical
+        stored = attempts_col.find_one({'_id': ObjectId(result['attempt_id'])})
+        assert stored['answers'][0]['choice_key'] == answer_keys[question_ids[0]], "Stored answers should use canonical keys"
+        print(f"   ✓ Attempt {attempt_num}: {actual:.1f}% (expected {expected:.1f}%)")
+    
+    print("\n✅ Displayed keys are mapped with the attempt's option order")
+    print("✅ STORY 7: PASS")
+
+
+def test_story_8_attempt_reservation(user_ids):
+    """
+    Story 8: As a user, each attempt is reserved atomically, and a failed
+    one is given back.
+    """
+    print("\n" + "=" * 60)
+    print("📖 TEST STORY 8: Attempt Reservation and Release")
+    print("=" * 60)
+    
+    today = date.today()
+    user_id = user_ids[1]
+    quiz_index = 5
+    
+    # Answers for the wrong attempt are refused
+    assert reserve_attempt_slot(user_id, today, quiz_index, expected_attempt=2) is None, \
+        "Attempt 2 should not be reservable before attempt 1"
+    assert reserve_attempt_slot(user_id, today, quiz_index, expected_attempt=1) == 1, \
+        "Attempt 1 should be reserved"
+    print("   ✓ Attempt 1 reserved (attempt 2 refused before it)")
+    
+    # A failed submit gives its attempt back
+    assert reserve_attempt_slot(user_id, today, quiz_index) == 2, "Attempt 2 should be reserved"
+    release_attempt_slot(user_id, today, quiz_index)
+    assert get_attempt_count(user_id, today, quiz_index) == 1, "Released attempt should not count"
+    print("   ✓ Released attempt 2 is available again")
+    
+    # The limit holds
+    for expected in range(2, MAX_ATTEMPTS + 1):
+        assert reserve_attempt_slot(user_id, today, quiz_index, expected_attempt=expected) == expected, \
+            f"Attempt {expected} should be reserved"
+    assert reserve_attempt_slot(user_id, today, quiz_index) is None, \
+        f"No attempt beyond {MAX_ATTEMPTS} should be reserved"
+    assert get_attempt_count(user_id, today, quiz_index) == MAX_ATTEMPTS, \
+        f"Attempt count should stay at {MAX_ATTEMPTS}"
+    print(f"   ✓ Attempt {MAX_ATTEMPTS + 1} refused")
+    
+    print("\n✅ Attempts are reserved atomically up to the limit")
+    print("✅ STORY 8: PASS")
+
+
+def test_story_9_keep_best_result(user_ids):
+    """
+    Story 9: As a user, only my best result counts (% correct, then faster time).
+    """
+    print("\n" + "=" * 60)
+    print("📖 TEST STORY 9: Keep-Best Results")
+    print("=" * 60)
+    
+    today = date.today()
+    today_str = today.isoformat()
+    user_id = user_ids[1]
+    user_oid = ObjectId(user_id)
+    quiz_index = 6
+    
+    scenarios = [
+        # (percentage, time_ms, expected is_best)
+        (60.0, 20000, True),    # First result
+        (50.0, 10000, False),   # Lower % (even if faster)
+        (60.0, 25000, False),   # Same %, slower
+        (60.0, 15000, True),    # Same %, faster
+        (80.0, 40000, True),    # Higher % (even if slower)
+        (80.0, 40000, False),   # Same % and time
+    ]
+    for percentage, time_ms, expected in scenarios:
+        is_best = upsert_best_result(user_id, today, quiz_index, percentage, time_ms, nickname='Bob')
+        assert is_best == expected, f"{percentage}% in {time_ms}ms: expected is_best={expected}, got {is_best}"
+        print(f"   ✓ {percentage:.0f}% in {time_ms/1000:.0f}s -> is_best={is_best}")
+    
+    key = {'user_id': user_oid, 'date': today_str, 'quiz_index': quiz_index}
+    result = results_col.find_one(key)
+    entry = leaderboard_col.find_one(key)
+    assert (result['best_pct'], result['best_time_ms']) == (80.0, 40000), "Results should keep the best"
+    assert (entry['best_pct'], entry['best_time_ms']) == (80.0, 40000), "Leaderboard should keep the best"
+    
+    # Daily totals sum the best of every quiz the user played today
+    bests = list(results_col.find({'user_id': user_oid, 'date': today_str, 'best_pct': {'$exists': True}}))
+    totals = daily_totals_col.find_one({'user_id': user_oid, 'date': today_str})
+    assert totals['quizzes_completed'] == len(bests), \
+        f"Totals should count {len(bests)} quizzes, got {totals['quizzes_completed']}"
+    assert abs(totals['total_pct'] - sum(r['best_pct'] for r in bests)) < 0.01, \
+        "Totals should sum the best percentages"
+    print(f"   ✓ Daily totals: {totals['quizzes_completed']} quizzes, {totals['avg_pct']:.1f}% average")
+    
+    print("\n✅ Only the best result is kept, everywhere")
+    print("✅ STORY 9: PASS")
+
+
+def test_story_10_leaderboard_pages():
+    """
+    Story 10: As a user, I can page through a leaderboard and see the
+    players around me.
+    """
+    print("\n" + "=" * 60)
+    print("📖 TEST STORY 10: Leaderboard Pages and Around-Me")
+    print("=" * 60)
+    
+    today = date.today()
+    quiz_index = 7
+    scores = [(90.0, 30000), (90.0, 35000), (80.0, 20000), (70.0, 25000),
+              (70.0, 26000), (70.0, 27000), (60.0, 10000)]
+    
+    # Players in expected rank order
+    player_ids = []
+    for i, (percentage, time_ms) in enumerate(scores):
+        nickname = f'Player{i + 1}'
+        user_id = str(users_col.insert_one({'nickname': nickname, 'email': f'player{i + 1}@test.com',
+                                            'role': 'user'}).inserted_id)
+        upsert_best_result(user_id, today, quiz_index, percentage, time_ms, nickname=nickname)
+        player_ids.append(user_id)
+    
+    # Walk every page
+    rows, cursor, pages = [], None, 0
+    while True:
+        page = get_leaderboard_page(today, quiz_index, limit=3, cursor=cursor)
+        rows.extend(page['leaderboard'])
+        pages += 1
+        cursor = page['next_cursor']
+        if cursor is None:
+            break
+    
+    assert pages == 3, f"7 players in pages of 3 should take 3 pages, got {pages}"
+    assert [row['rank'] for row in rows] == list(range(1, len(scores) + 1)), "Ranks should be contiguous"
+    assert [row['user_id'] for row in rows] == player_ids, "Pages should list players in rank order"
+    print(f"   ✓ {len(rows)} players over {pages} pages, in rank order")
+    
+    # Around the 4th player
+    window = get_leaderboard_around_user(player_ids[3], today, quiz_index, radius=2)
+    assert window['rank'] == 4, f"Player4 should be rank 4, got {window['rank']}"
+    assert [row['user_id'] for row in window['leaderboard']] == player_ids[1:6], \
+        "Window should hold two players on either side"
+    assert [row['rank'] for row in window['leaderboard']] == [2, 3, 4, 5, 6], "Window ranks should match"
+    
+    # At the top, the window is cut short above
+    window = get_leaderboard_around_user(player_ids[0], today, quiz_index, radius=2)
+    assert [row['rank'] for row in window['leaderboard']] == [1, 2, 3], "Top window should start at rank 1"
+    print("   ✓ Around-me windows centre on the player")
+    
+    print("\n✅ Keyset pages and around-me windows are consistent")
+    print("✅ STORY 10: PASS")
+
+
+def test_story_11_legacy_tracker_migration():
+    """
+    Story 11: As an operator, a legacy usage tracker (one array of used
+    question ids) is migrated onto the questions.
+    """
+    print("\n" + "=" * 60)
+    print("📖 TEST STORY 11: Legacy Usage Tracker Migration")
+    print("=" * 60)
+    
+    legacy_ids = [q['_id'] for q in questions_col.find({}, {'_id': 1}).limit(5)]
+    used_questions_col.delete_many({})
+    used_questions_col.insert_one({
+        '_id': 'global_tracker',
+        'question_ids': [str(q_id) for q_id in legacy_ids]
+    })
+    
+    cycle = get_usage_cycle()
+    
+    tracker = used_questions_col.find_one({'_id': 'global_tracker'})
+    assert 'question_ids' not in tracker, "Legacy array should be removed"
+    assert tracker['cycle'] == cycle, "Tracker should hold the cycle"
+    marked = questions_col.count_documents({'_id': {'$in': legacy_ids}, 'last_used_cycle': cycle})
+    assert marked == len(legacy_ids), f"All {len(legacy_ids)} legacy questions should be used, got {marked}"
+    print(f"   ✓ {marked} legacy questions marked used in cycle {cycle}")
+    
+    # Running it again changes nothing
+    assert get_usage_cycle() == cycle, "Cycle should not change"
+    
+    print("\n✅ Legacy tracker migrated")
+    print("✅ STORY 11: PASS")
+
+
 def run_all_tests():
     """Run all POC tests"""
     try:
@@ -388,6 +635,11 @@ def run_all_tests():
         test_story_4_lock_after_answers(user_id, quiz_index)
         test_story_5_leaderboard_ranking(user_ids)
         test_story_6_deterministic_generation()
+        test_story_7_displayed_key_scoring(user_ids)
+        test_story_8_attempt_reservation(user_ids)
+        test_story_9_keep_best_result(user_ids)
+        test_story_10_leaderboard_pages()
+        test_story_11_legacy_tracker_migration()
         
         # Summary
         print("\n" + "=" * 60)
@@ -400,6 +652,11 @@ def run_all_tests():
         print("   ✓ Quiz lock after viewing answers")
         print("   ✓ Leaderboard ranking (% then time)")
         print("   ✓ Deterministic pack generation")
+        print("   ✓ Scoring with per-attempt option order")
+        print("   ✓ Atomic attempt reservation and release")
+        print("   ✓ Keep-best results, leaderboards and daily totals")
+        print("   ✓ Leaderboard pages and around-me windows")
+        print("   ✓ Legacy usage tracker migration")
         print("\n🚀 Ready to build full application!")
         print("=" * 60)
         
@@ -129,6 +129,7 @@ export const userAPI = {
   // Quiz
   getQuiz: (quizIndex, lang = 'en') => api.get(`/api/quizzes/${quizIndex}`, { params: { lang } }),
   submitQuiz: (quizIndex, data) => api.post(`/api/quizzes/${quizIndex}/submit`, data),
+  getAttemptBadges: (attemptId) => api.get(`/api/attempts/${attemptId}/badges`),
   getAnswers: (quizIndex, lang = 'en') => api.get(`/api/quizzes/${quizIndex}/answers`, { params: { lang } }),
   lockQuiz: (quizIndex, applyPenalty = false) => api.post(`/api/quizzes/${quizIndex}/lock`, null, { params: { apply_penalty: applyPenalty } }),
   getLeaderboard: (quizIndex, groupId) => api.get(`/api/quizzes/${quizIndex}/leaderboard`, { params: { group_id: groupId } }),
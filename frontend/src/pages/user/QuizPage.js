@@ -134,7 +134,8 @@ export function QuizPage() {
           question_id: q._id,
           choice_key: answers[q._id] || 'UNANSWERED' // Mark as unanswered if no answer
         })),
-        time_ms: timeMs
+        time_ms: timeMs,
+        attempt_number: quiz.attempt_number // Option order the answers refer to
       });
       
       toast.success('Quiz submitted successfully!');
@@ -29,6 +29,38 @@ export function ResultsPage() {
     }
   }, [result]);
 
+  // Badges are awarded in the background after submit - poll until they are ready
+  useEffect(() => {
+    if (!result?.badges_pending || !result?.attempt_id) return;
+
+    let cancelled = false;
+    let tries = 0;
+    const poll = async () => {
+      tries += 1;
+      try {
+        const res = await userAPI.getAttemptBadges(result.attempt_id);
+        if (cancelled) return;
+        if (!res.data.badges_pending) {
+          if (res.data.badges_earned?.length > 0) {
+            setEarnedBadges(res.data.badges_earned);
+          }
+          return;
+        }
+      } catch (error) {
+        console.log('Failed to load earned badges:', error);
+      }
+      if (!cancelled && tries < 10) {
+        setTimeout(poll, 1000);
+      }
+    };
+    const timer = setTimeout(poll, 500);
+
+    return () => {
+      cancelled = true;
+      clearTimeout(timer);
+    };
+  }, [result?.attempt_id, result?.badges_pending]);
+
   const canViewAnswers = result?.can_view_answers;  // Can view after any attempt now
   const canRetry = result?.attempts_remaining > 0 && !result?.quiz_locked && !showAnswers;
   const isPerfect = result?.is_perfect || result?.score?.percentage === 100;